@@ -0,0 +1,182 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .client import NotionClient
+from .collection import CollectionQuery
+from .logger import logger
+from .store import Missing
+from .utils import extract_id
+
+
+class AsyncNotionClient(object):
+    """
+    An asyncio-based counterpart to `NotionClient`, for jobs that need to touch many records at once. It wraps a
+    regular `NotionClient` (available as `.client`), sharing its `RecordStore`, and returns the same `Block`,
+    `Collection`, etc instances, but its methods are coroutines whose underlying HTTP requests are run in worker
+    threads, so that independent requests (e.g. `await asyncio.gather(...)`) run concurrently, with no more than
+    `concurrency` requests in flight at once.
+
+    Note that constructing the client makes a (blocking) request to load the current user's info; to avoid that,
+    pass in an existing `NotionClient` instance as `client`.
+    """
+
+    def __init__(self, token_v2=None, concurrency=10, client=None, **kwargs):
+        self.concurrency = concurrency
+        kwargs.setdefault("max_workers", concurrency)
+        self.client = client or NotionClient(token_v2=token_v2, **kwargs)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Shut down the worker threads used for running requests.
+        """
+        self._executor.shutdown(wait=False)
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        Run a blocking function (usually one that makes a request) in a worker thread, and wait for the result.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(func, *args, **kwargs)
+            )
+
+    async def post(self, endpoint, data):
+        return await self._run(self.client.post, endpoint, data)
+
+    async def get_record_data(self, table, id, force_refresh=False, limit=100):
+        return await self._run(
+            self.client.get_record_data,
+            table,
+            id,
+            force_refresh=force_refresh,
+            limit=limit,
+        )
+
+    async def get_block(self, url_or_id, force_refresh=False, limit=100):
+        return await self._run(
+            self.client.get_block, url_or_id, force_refresh=force_refresh, limit=limit
+        )
+
+    async def get_blocks(self, urls_or_ids, force_refresh=False, batch_size=100):
+        """
+        Retrieve Block instances for all of the URLs or IDs passed in. Any that aren't in the local cache (or all of
+        them, if `force_refresh` is True) are loaded in batches of `batch_size`, with the batches run concurrently.
+        Blocks that couldn't be loaded (e.g. they don't exist, or aren't accessible) are returned as None.
+        """
+        block_ids = [extract_id(url_or_id) for url_or_id in urls_or_ids]
+        await self.refresh_records(
+            batch_size=batch_size,
+            missing_only=not force_refresh,
+            block=block_ids,
+        )
+        # only build instances for blocks that are now in the store, as anything else would be loaded (blocking)
+        store = self.client._store
+        return [
+            self.client.get_block(block_id) if store._get("block", block_id) else None
+            for block_id in block_ids
+        ]
+
+    async def get_collection(self, collection_id, force_refresh=False):
+        return await self._run(
+            self.client.get_collection, collection_id, force_refresh=force_refresh
+        )
+
+    async def get_collection_view(
+        self, url_or_id, collection=None, force_refresh=False
+    ):
+        return await self._run(
+            self.client.get_collection_view,
+            url_or_id,
+            collection=collection,
+            force_refresh=force_refresh,
+        )
+
+    async def get_user(self, user_id, force_refresh=False):
+        return await self._run(
+            self.client.get_user, user_id, force_refresh=force_refresh
+        )
+
+    async def get_space(self, space_id, force_refresh=False):
+        return await self._run(
+            self.client.get_space, space_id, force_refresh=force_refresh
+        )
+
+    async def refresh_records(self, batch_size=100, missing_only=False, **kwargs):
+        """
+        The keyword arguments map table names into lists of (or singular) record IDs to load for that table, as for
+        `NotionClient.refresh_records`. The records are loaded in batches of `batch_size`, run concurrently. If
+        `missing_only` is True, records that are already in the local cache are skipped; otherwise, only records
+        that have changed on the server since they were last loaded are downloaded again.
+        """
+        store = self.client._store
+        # records we're refreshing can be synced against the versions we have, whereas missing ones just get loaded
+        if missing_only:
+            load = store.call_get_record_values
+        else:
+            load = store.call_sync_record_values
+        batches = []
+        for table, ids in kwargs.items():
+            if isinstance(ids, str):
+                ids = [ids]
+            ids = [extract_id(id) for id in ids]
+            if missing_only:
+                ids = [id for id in ids if store._get(table, id) is Missing]
+            ids = list(dict.fromkeys(ids))
+            for i in range(0, len(ids), batch_size):
+                batches.append({table: ids[i : i + batch_size]})
+        logger.debug(
+            "Loading records asynchronously in {} batches".format(len(batches))
+        )
+        await asyncio.gather(*[self._run(load, **batch) for batch in batches])
+
+    def build_query(self, collection, collection_view=None, **kwargs):
+        """
+        Build a query against `collection` (through `collection_view`, or an arbitrary view of the collection if
+        not provided), whose `execute` method is a coroutine.
+        """
+        return AsyncCollectionQuery(
+            self,
+            collection,
+            collection_view or collection._get_a_collection_view(),
+            space_id=collection.get("space_id"),
+            **kwargs
+        )
+
+    async def query(self, collection, **kwargs):
+        """
+        Query `collection` (see `Collection.query`), returning a QueryResult.
+        """
+        query = await self._run(self.build_query, collection, **kwargs)
+        return await query.execute()
+
+    async def submit_transaction(self, operations, update_last_edited=True):
+        await self._run(
+            self.client.submit_transaction,
+            operations,
+            update_last_edited=update_last_edited,
+        )
+
+
+class AsyncCollectionQuery(CollectionQuery):
+    """
+    A CollectionQuery whose `execute` method is a coroutine, run through an `AsyncNotionClient`.
+    """
+
+    def __init__(self, async_client, *args, **kwargs):
+        self._async_client = async_client
+        super().__init__(*args, **kwargs)
+
+    async def execute(self):
+        return await self._async_client._run(super().execute)
@@ -1,15 +1,11 @@
-import io
-import mimetypes
-import os
 import random
-import requests
 import time
 import uuid
-import zipfile
 
 from cached_property import cached_property
 from copy import deepcopy
 
+from .export import MarkdownExporter, ServerExporter
 from .logger import logger
 from .maps import property_map, field_map, mapper
 from .markdown import plaintext_to_notion, notion_to_plaintext
@@ -31,6 +27,9 @@ class Children(object):
 
     child_list_key = "content"
 
+    # the table that the IDs in the child list refer to
+    child_table = "block"
+
     def __init__(self, parent):
         self._parent = parent
         self._client = parent._client
@@ -40,6 +39,13 @@ class Children(object):
         random.shuffle(content)
         self._parent.set(self.child_list_key, content)
 
+    def prefetch(self, depth=0):
+        """
+        Load all the children that aren't in the local cache yet in a few batched requests, rather than one at a
+        time as they're accessed. If `depth` is above zero, their descendants are loaded too, to that many levels.
+        """
+        self._client.prefetch(depth=depth, **{self.child_table: self._content_list()})
+
     def filter(self, type=None):
         kids = list(self)
         if type:
@@ -85,18 +91,24 @@ class Children(object):
     def __getitem__(self, key):
         result = self._content_list()[key]
         if isinstance(result, list):
+            self._client.prefetch(**{self.child_table: result})
             return [self._get_block(id) for id in result]
         else:
+            if not self._client._store._get(self.child_table, result):
+                # if one child is missing, chances are its siblings are too, so load them all in one go
+                self.prefetch()
             return self._get_block(result)
 
     def __delitem__(self, key):
         self._get_block(self._content_list()[key]).remove()
 
     def __iter__(self):
+        self.prefetch()
         return iter(self._get_block(id) for id in self._content_list())
 
     def __reversed__(self):
-        return reversed(iter(self))
+        self.prefetch()
+        return iter(self._get_block(id) for id in reversed(self._content_list()))
 
     def __contains__(self, item):
         if isinstance(item, str):
@@ -349,7 +361,7 @@ class Block(Record):
                 self._client.post(
                     "deleteBlocks", {"blockIds": [block_id], "permanentlyDelete": True}
                 )
-                del self._client._store._values["block"][block_id]
+                self._client._store.remove_record("block", block_id)
 
         else:
 
@@ -428,47 +440,25 @@ class Block(Record):
         )
 
     def extract_markdown(self):
-        task_id = self._client.post("https://www.notion.so/api/v3/enqueueTask", {
-            "task": {
-                "eventName": "exportBlock",
-                "request": {
-                    "block": {
-                        "id": self.id,
-                        "spaceId": self._client.current_space.id,
-                    },
-                    "recursive": False,
-                    "exportOptions": {
-                        "exportType": "markdown",
-                        "timeZone": "America/Los_Angeles",
-                        "locale": "en",
-                        "collectionViewExportType": "currentView",
-                        "includeContents": "no_files",
-                        "preferredViewMap": {}
-                    },
-                    "shouldExportComments": False
-                }
-            }
-        }).json()["taskId"]
-
-        for i in range(5000):
-            response = self._client.post("https://www.notion.so/api/v3/getTasks", {
-                "taskIds": [task_id]
-            }).json()
-            if response["results"][0]["state"] == "success":
-                break
-            time.sleep(0.25)
-
-        zip_url = response["results"][0]["status"]["exportURL"]
-
-        response = self._client.session.get(zip_url)
-        response.raise_for_status()
-
-        # unzip the contents in memory and read the contents of the file inside (there should only be one file, but check the name)
-        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
-            names = z.namelist()
-            assert len(names) == 1, "Expected exactly one file in the zip"
-            with z.open(names[0]) as f:
-                return f.read().decode("utf-8")
+        """
+        Export this page through Notion's server-side export, returning the markdown (see `ServerExporter`, for
+        exporting many pages at once).
+        """
+        return ServerExporter(self._client).extract_markdown(self)
+
+    def export_markdown(self, out=None, directory=None, recursive=False):
+        """
+        Render this page to markdown locally, from the records in the local store (loading any that are missing),
+        rather than through Notion's export. If `out` is a file-like object, the markdown is streamed into it,
+        otherwise it's returned as a string. Alternatively, pass `directory` to write it to a file there (returning
+        its path), with `recursive=True` to also write out its sub-pages. See `MarkdownExporter` for details.
+        """
+        exporter = MarkdownExporter(self._client, recursive=recursive)
+        if directory is not None:
+            return exporter.export(self, directory)
+        if out is None:
+            return exporter.render(self)
+        exporter.write(self, out)
 
 
 class DividerBlock(Block):
@@ -678,25 +668,14 @@ class EmbedOrUploadBlock(EmbedBlock):
 
     file_id = field_map(["file_ids", 0])
 
-    def upload_file(self, path):
-
-        mimetype = mimetypes.guess_type(path)[0] or "text/plain"
-        filename = os.path.split(path)[-1]
-
-        data = self._client.post(
-            "getUploadFileUrl",
-            {"bucket": "secure", "name": filename, "contentType": mimetype},
-        ).json()
-
-        with open(path, "rb") as f:
-            response = requests.put(
-                data["signedPutUrl"], data=f, headers={"Content-type": mimetype}
-            )
-            response.raise_for_status()
-
-        self.display_source = data["url"]
-        self.source = data["url"]
-        self.file_id = data["url"][len(S3_URL_PREFIX) :].split("/")[0]
+    def upload_file(self, path, progress=None):
+        """
+        Upload a file and set it as this block's source (see `NotionClient.upload_file`).
+        """
+        url = self._client.upload_file(path, progress=progress)
+        self.display_source = url
+        self.source = url
+        self.file_id = url[len(S3_URL_PREFIX) :].split("/")[0]
 
 
 class VideoBlock(EmbedOrUploadBlock):
@@ -804,6 +783,8 @@ class CollectionViewBlockViews(Children):
 
     child_list_key = "view_ids"
 
+    child_table = "collection_view"
+
     def _get_block(self, view_id):
 
         view = self._client.get_collection_view(
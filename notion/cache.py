@@ -0,0 +1,280 @@
+import json
+import mmap
+import os
+import pickle
+import re
+import threading
+
+from collections import defaultdict
+from threading import Lock
+
+from .logger import logger
+
+# matches the header of a log line, up to the start of the JSON payload
+_ENTRY_HEADER_REGEX = re.compile(rb"([^\t\n]*)\t([^\t\n]*)\t(-?\d+)\t")
+
+# bumped whenever the layout of the saved index changes, so that old ones are ignored
+_INDEX_FORMAT = 1
+
+
+class RecordCache(object):
+    """
+    Persistent on-disk cache of record data, stored as an append-only log. Each line holds one entry, keyed
+    by (table, id, version), in the form "<table>\t<id>\t<version>\t<json payload>". The payload is a dict with
+    the record's "value" and "role", or null for a record that has been removed. Later entries for the same
+    record supersede earlier ones, so writing only requires appending the records that actually changed, and
+    the log is periodically compacted (in a background thread) to drop superseded entries.
+
+    The log is memory-mapped, and payloads are deserialized one at a time, as records are read. The index of
+    where the latest entry for each record lives is saved alongside the log (after each compaction, and every
+    `index_interval` entries), along with how far into the log it covers, so that opening the cache only loads
+    the saved index and scans the headers of the entries appended since.
+    """
+
+    # only compact once there are at least this many entries in the log...
+    compact_min_entries = 10000
+    # ...and at least this many entries per live record (i.e. most of the log is superseded entries)
+    compact_ratio = 2
+
+    # save the index once at least this many entries have been appended since it was last saved
+    index_interval = 10000
+
+    def __init__(self, path):
+        self._path = path
+        self._index_path = path + ".index"
+        self._indexed_count = 0
+        self._mutex = Lock()
+        self._index = defaultdict(dict)
+        self._size = 0
+        self._map = None
+        self._entry_count = 0
+        self._compacting = False
+
+    def open(self):
+        """
+        Index the existing log on disk, if there is one.
+        """
+        with self._mutex:
+            self._index = defaultdict(dict)
+            self._entry_count = 0
+            self._size = 0
+            self._close_map()
+            try:
+                self._size = os.path.getsize(self._path)
+            except FileNotFoundError:
+                return
+            self._index_entries(self._load_index())
+
+    def _load_index(self):
+        """
+        Load the saved index, if there's a usable one, returning the offset in the log up to which it covers.
+        """
+        try:
+            with open(self._index_path, "rb") as f:
+                saved = pickle.load(f)
+            if saved["format"] != _INDEX_FORMAT:
+                return 0
+            offset = saved["offset"]
+            # make sure the log hasn't been replaced or truncated since the index was saved
+            if offset > self._size or self._get_tail(offset) != saved["tail"]:
+                return 0
+        except FileNotFoundError:
+            return 0
+        except Exception as e:
+            logger.warning(
+                "Ignoring unreadable record cache index {} ({!r})".format(
+                    self._index_path, e
+                )
+            )
+            return 0
+        self._index = defaultdict(dict, saved["index"])
+        self._entry_count = saved["entry_count"]
+        self._indexed_count = self._entry_count
+        return offset
+
+    def _get_tail(self, offset):
+        # the end of the log up to `offset`, which identifies it well enough to tell if it's been rewritten
+        if not offset:
+            return b""
+        return self._get_map()[max(offset - 256, 0) : offset]
+
+    def _save_index(self):
+        """
+        Write out the index (which must be up to date with the whole log), via a temporary file. Called with the
+        mutex held.
+        """
+        saved = {
+            "format": _INDEX_FORMAT,
+            "offset": self._size,
+            "tail": self._get_tail(self._size),
+            "entry_count": self._entry_count,
+            "index": dict(self._index),
+        }
+        tmp_path = self._index_path + ".tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._index_path)
+            self._indexed_count = self._entry_count
+        except OSError as e:
+            logger.warning(
+                "Couldn't save record cache index {} ({!r})".format(self._index_path, e)
+            )
+
+    def _index_entries(self, start):
+        """
+        Scan the entry headers from the byte offset `start` onwards, recording the location of each entry.
+        """
+        data = self._get_map()
+        if data is None:
+            return
+        pos = start
+        while pos < self._size:
+            end = data.find(b"\n", pos, self._size)
+            if end == -1:
+                # a partially written final line, from a process that was interrupted mid-write
+                logger.warning(
+                    "Ignoring truncated entry in record cache {}".format(self._path)
+                )
+                break
+            match = _ENTRY_HEADER_REGEX.match(data, pos, end)
+            if match:
+                table, id, version = (g.decode("utf-8") for g in match.groups())
+                self._entry_count += 1
+                if end - match.end() == 4 and data[match.end() : end] == b"null":
+                    self._index[table].pop(id, None)
+                else:
+                    self._index[table][id] = (pos, match.end(), end, int(version))
+            else:
+                logger.warning(
+                    "Skipping corrupt line in record cache {}".format(self._path)
+                )
+            pos = end + 1
+
+    def _get_map(self):
+        if self._map is None or len(self._map) < self._size:
+            self._close_map()
+            if not self._size:
+                return None
+            with open(self._path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _close_map(self):
+        # just drop our reference rather than closing it, in case a compaction is still reading from it
+        self._map = None
+
+    def __contains__(self, key):
+        table, id = key
+        return id in self._index.get(table, {})
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._index.values())
+
+    def ids(self, table):
+        """
+        Return a list of the IDs of all records in the cache for the specified table.
+        """
+        return list(self._index.get(table, {}).keys())
+
+    def get_version(self, table, id):
+        """
+        Return the version number of the cached copy of a record (without deserializing it), or -1 if unknown.
+        """
+        location = self._index.get(table, {}).get(id)
+        return location[3] if location else -1
+
+    def read(self, table, id):
+        """
+        Deserialize and return the cached payload (a dict with "value" and "role") for a record, or None.
+        """
+        with self._mutex:
+            location = self._index.get(table, {}).get(id)
+            if not location:
+                return None
+            raw = self._get_map()[location[1] : location[2]]
+        return json.loads(raw.decode("utf-8"))
+
+    def _format_line(self, table, id, version, payload):
+        return "{}\t{}\t{}\t{}\n".format(
+            table, id, version, json.dumps(payload, separators=(",", ":"))
+        ).encode("utf-8")
+
+    def write(self, records):
+        """
+        Append entries to the log for each of the provided (table, id, value, role) tuples. A value of None
+        records that the record has been removed from the store.
+        """
+        if not records:
+            return
+        lines = []
+        for table, id, value, role in records:
+            if value is None:
+                lines.append(self._format_line(table, id, -1, None))
+            else:
+                version = value.get("version", -1)
+                payload = {"value": value, "role": role}
+                lines.append(self._format_line(table, id, version, payload))
+        with self._mutex:
+            with open(self._path, "ab") as f:
+                f.write(b"".join(lines))
+            start = self._size
+            self._size += sum(len(line) for line in lines)
+            self._index_entries(start)
+            if self._entry_count - self._indexed_count >= self.index_interval:
+                self._save_index()
+            needs_compaction = self._needs_compaction()
+            if needs_compaction:
+                self._compacting = True
+        if needs_compaction:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def _needs_compaction(self):
+        return (
+            not self._compacting
+            and self._entry_count >= self.compact_min_entries
+            and self._entry_count >= self.compact_ratio * max(len(self), 1)
+        )
+
+    def compact(self):
+        """
+        Rewrite the log to contain only the latest entry for each live record. Entries appended while the
+        compaction is running are carried over before the new log is swapped into place.
+        """
+        try:
+            with self._mutex:
+                end = self._size
+                locations = [
+                    (start, stop + 1)
+                    for ids in self._index.values()
+                    for start, _, stop, _ in ids.values()
+                    if stop < end
+                ]
+                data = self._get_map()
+            if data is None:
+                return
+
+            tmp_path = self._path + ".compacting"
+            with open(tmp_path, "wb") as out:
+                for start, stop in sorted(locations):
+                    out.write(data[start:stop])
+
+            # carry over anything that was appended in the meantime, and swap in the compacted log
+            with self._mutex:
+                with open(tmp_path, "ab") as out:
+                    out.write(self._get_map()[end : self._size])
+                self._close_map()
+                os.replace(tmp_path, self._path)
+                self._index = defaultdict(dict)
+                self._entry_count = 0
+                self._size = os.path.getsize(self._path)
+                self._index_entries(0)
+                self._save_index()
+
+            logger.debug(
+                "Compacted record cache {} down to {} entries".format(
+                    self._path, self._entry_count
+                )
+            )
+        finally:
+            self._compacting = False
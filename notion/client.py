@@ -1,9 +1,15 @@
 import hashlib
 import json
+import mimetypes
+import os
 import re
+import threading
+import time
 import uuid
 
-from requests import Session, HTTPError
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from requests import Session, HTTPError, RequestException
 from requests.cookies import cookiejar_from_dict
 from urllib.parse import urljoin
 from requests.adapters import HTTPAdapter
@@ -28,9 +34,9 @@ from .user import User
 from .utils import extract_id, now
 
 
-def create_session(client_specified_retry=None):
+def create_session(client_specified_retry=None, pool_maxsize=10):
     """
-    retry on 502
+    retry on 502; `pool_maxsize` is the number of connections to keep open (and reuse) per host
     """
     session = Session()
     if client_specified_retry:
@@ -51,11 +57,23 @@ def create_session(client_specified_retry=None):
                 "DELETE",
             ),
         )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
     session.mount("https://", adapter)
     return session
 
 
+# tracks whether the current thread is running a task on a client's thread pool
+_worker_state = threading.local()
+
+
+def _call_in_worker(func, *args, **kwargs):
+    _worker_state.active = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _worker_state.active = False
+
+
 class NotionClient(object):
     """
     This is the entry point to using the API. Create an instance of this class, passing it the value of the
@@ -63,6 +81,10 @@ class NotionClient(object):
     for internal use -- the main one you'll likely want to use is `get_block`.
     """
 
+    # how many times to retry a failed file upload, and the initial delay (in seconds) between attempts
+    upload_retries = 3
+    upload_backoff = 1
+
     def __init__(
         self,
         token_v2=None,
@@ -73,18 +95,35 @@ class NotionClient(object):
         email=None,
         password=None,
         client_specified_retry=None,
+        max_workers=1,
+        max_records_per_table=None,
+        max_bytes_per_table=None,
     ):
-        self.session = create_session(client_specified_retry)
+        # when `max_workers` is above 1, independent requests (e.g. batches of records to load) are run in parallel
+        self.max_workers = max(max_workers or 1, 1)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._bulk_writer = None
+        self._upload_session = None
+        self._upload_pool_size = 0
+        self.session = create_session(
+            client_specified_retry, pool_maxsize=max(self.max_workers, 10)
+        )
         if token_v2:
             self.session.cookies = cookiejar_from_dict({"token_v2": token_v2})
         else:
             self._set_token(email=email, password=password)
 
+        # optional bounds on how many records to keep in memory; see RecordStore for details
+        store_kwargs = {
+            "max_records_per_table": max_records_per_table,
+            "max_bytes_per_table": max_bytes_per_table,
+        }
         if enable_caching:
             cache_key = cache_key or hashlib.sha256(token_v2.encode()).hexdigest()
-            self._store = RecordStore(self, cache_key=cache_key)
+            self._store = RecordStore(self, cache_key=cache_key, **store_kwargs)
         else:
-            self._store = RecordStore(self)
+            self._store = RecordStore(self, **store_kwargs)
         if monitor:
             self._monitor = Monitor(self)
             if start_monitoring:
@@ -96,6 +135,42 @@ class NotionClient(object):
 
     def start_monitoring(self):
         self._monitor.poll_async()
+
+    def _get_executor(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _map(self, func, items):
+        """
+        Call `func` on each of the items, returning a list of the results (in order). If the client was created
+        with `max_workers` above 1, the calls are run in parallel on the client's shared thread pool.
+        """
+        items = list(items)
+        if (
+            self.max_workers <= 1
+            or len(items) <= 1
+            or getattr(_worker_state, "active", False)
+        ):
+            return [func(item) for item in items]
+        executor = self._get_executor()
+        futures = [executor.submit(_call_in_worker, func, item) for item in items]
+        return [future.result() for future in futures]
+
+    def _submit(self, func, *args, **kwargs):
+        """
+        Start running `func` in the background on the client's shared thread pool, returning a Future.
+        """
+        if getattr(_worker_state, "active", False):
+            # we're already on the thread pool, so run it right away rather than risk waiting on ourselves
+            future = Future()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._get_executor().submit(_call_in_worker, func, *args, **kwargs)
     
     def _fetch_guest_space_data(self, records):
         """
@@ -156,7 +231,7 @@ class NotionClient(object):
 
     def get_top_level_pages(self):
         records = self._update_user_info()
-        return [self.get_block(bid) for bid in records["block"].keys()]
+        return self._map(self.get_block, records["block"].keys())
 
     def get_record_data(self, table, id, force_refresh=False, limit=100):
         return self._store.get(table, id, force_refresh=force_refresh, limit=limit)
@@ -178,6 +253,17 @@ class NotionClient(object):
             block_class = BLOCK_TYPES.get(block.get("type", ""), Block)
         return block_class(self, block_id)
 
+    def iter_page_chunks(self, url_or_id, limit=100):
+        """
+        Generator that loads the page identified by the URL or ID passed in a chunk at a time (following the
+        server's cursor until the whole page has been loaded), yielding a list of the Block instances in each
+        chunk as it arrives, so that the first blocks can be used before the rest of the page has loaded.
+        """
+        page_id = extract_id(url_or_id)
+        for block_ids in self._store.iter_page_chunks(page_id, limit=limit):
+            blocks = [self.get_block(block_id) for block_id in block_ids]
+            yield [block for block in blocks if block is not None]
+
     def get_collection(self, collection_id, force_refresh=False):
         """
         Retrieve an instance of Collection that maps to the collection identified by the ID passed in.
@@ -237,9 +323,22 @@ class NotionClient(object):
     def refresh_records(self, **kwargs):
         """
         The keyword arguments map table names into lists of (or singular) record IDs to load for that table.
-        Use `True` instead of a list to refresh all known records for that table.
+        Use `True` instead of a list to refresh all known records for that table. Only records that have changed
+        on the server since they were last loaded are downloaded again.
         """
-        self._store.call_get_record_values(**kwargs)
+        self._store.call_sync_record_values(**kwargs)
+
+    def prefetch(self, depth=0, **kwargs):
+        """
+        Load any of the specified records that aren't already in the local cache, using a few batched requests
+        rather than one request per record. The keyword arguments map table names into lists of record IDs (or
+        `Record` instances). For blocks, their descendants are also loaded, down to `depth` levels deep.
+        """
+        for table, ids in kwargs.items():
+            if not isinstance(ids, (list, tuple, set)):
+                ids = [ids]
+            kwargs[table] = [getattr(id, "id", id) for id in ids]
+        self._store.prefetch(depth=depth, **kwargs)
 
     def refresh_collection_rows(self, collection_id):
         row_ids = [row.id for row in self.get_collection(collection_id).get_rows()]
@@ -285,6 +384,8 @@ class NotionClient(object):
         # if we're in a transaction, just add these operations to the list; otherwise, execute them right away
         if self.in_transaction():
             self._transaction_operations += operations
+        elif self._bulk_writer is not None:
+            self._bulk_writer.submit(operations)
         else:
             data = {"operations": operations}
             self.post("submitTransaction", data)
@@ -300,6 +401,19 @@ class NotionClient(object):
         """
         return Transaction(client=self)
 
+    def bulk_writer(self, max_ops=200, max_bytes=1000000, concurrency=4, retries=3):
+        """
+        Returns a context manager for submitting a large number of operations, which are split into batches that
+        are sent in parallel (see `BulkWriter`). Any transactions submitted while it's active go through it too.
+        """
+        return BulkWriter(
+            self,
+            max_ops=max_ops,
+            max_bytes=max_bytes,
+            concurrency=concurrency,
+            retries=retries,
+        )
+
     def in_transaction(self):
         """
         Returns True if we're currently in a transaction, otherwise False.
@@ -403,6 +517,101 @@ class NotionClient(object):
 
         return record_id
 
+    def _get_upload_session(self, concurrency=1):
+        # uploads go to S3 rather than Notion, so they use their own (pooled) session, without our cookies; it
+        # doesn't retry by itself, since a file being streamed has to be rewound before it can be sent again. It's
+        # replaced by a bigger one if there are to be more uploads at once than it can keep connections open for.
+        with self._executor_lock:
+            if self._upload_session is None or self._upload_pool_size < concurrency:
+                self._upload_pool_size = max(concurrency, self.max_workers, 10)
+                self._upload_session = create_session(
+                    Retry(total=0, raise_on_status=False),
+                    pool_maxsize=self._upload_pool_size,
+                )
+            return self._upload_session
+
+    def upload_file(self, path, progress=None):
+        """
+        Upload a file into Notion's storage, returning its URL. If provided, `progress` is called as the file is
+        sent, with the path, the number of bytes sent so far, and the file's size.
+        """
+        mimetype = mimetypes.guess_type(path)[0] or "text/plain"
+        filename = os.path.split(path)[-1]
+
+        data = self.post(
+            "getUploadFileUrl",
+            {"bucket": "secure", "name": filename, "contentType": mimetype},
+        ).json()
+
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            for attempt in range(self.upload_retries + 1):
+                # start again from the beginning, as the upload can't be resumed part way through
+                f.seek(0)
+                stream = UploadStream(f, size, path, progress)
+                try:
+                    response = self._get_upload_session().put(
+                        data["signedPutUrl"],
+                        data=stream,
+                        headers={"Content-type": mimetype},
+                    )
+                    response.raise_for_status()
+                    break
+                except RequestException as e:
+                    status = getattr(e.response, "status_code", None) or 500
+                    if attempt >= self.upload_retries or (
+                        status < 500 and status != 429
+                    ):
+                        raise
+                    logger.warning(
+                        "Upload of {} failed ({!r}); retrying".format(path, e)
+                    )
+                    time.sleep(self.upload_backoff * 2**attempt)
+
+        return data["url"]
+
+    def upload_files(self, paths, concurrency=4, progress=None):
+        """
+        Upload a number of files into Notion's storage, returning a list of their URLs (in the same order). Up to
+        `concurrency` files are signed and uploaded at once. If any of the uploads fail, the first error is raised
+        once the others have finished. See `upload_file` for details.
+        """
+        paths = list(paths)
+        concurrency = max(concurrency or 1, 1)
+        # make sure there's a connection to keep open for each of the uploads
+        self._get_upload_session(concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [
+                executor.submit(self.upload_file, path, progress=progress)
+                for path in paths
+            ]
+            wait(futures)
+        return [future.result() for future in futures]
+
+
+class UploadStream(object):
+    """
+    Wraps a file being uploaded, so that it's streamed from disk (a block at a time, as the request reads it)
+    while reporting on its progress.
+    """
+
+    def __init__(self, file, size, path, progress=None):
+        self._file = file
+        self._size = size
+        self._path = path
+        self._progress = progress
+        self._sent = 0
+
+    def __len__(self):
+        return self._size
+
+    def read(self, size=-1):
+        chunk = self._file.read(size)
+        if chunk and self._progress:
+            self._sent += len(chunk)
+            self._progress(self._path, self._sent, self._size)
+        return chunk
+
 
 class Transaction(object):
 
@@ -435,3 +644,266 @@ class Transaction(object):
             self.client.submit_transaction(operations)
 
         self.client._store.handle_post_transaction_refreshing()
+
+
+class BulkWriteError(Exception):
+    """
+    Raised by a `BulkWriter` when some of the operations it was given couldn't be submitted. The `failures`
+    attribute is a list of (operations, exception) tuples, for each part of a batch that failed (even after
+    retrying), or wasn't attempted because an earlier batch touching the same records had failed.
+    """
+
+    def __init__(self, failures, total):
+        self.failures = failures
+        failed = sum(len(operations) for operations, _ in failures)
+        super().__init__(
+            "Failed to submit {} of {} operations (first error: {!r})".format(
+                failed, total, failures[0][1]
+            )
+        )
+
+
+class WriteBatch(object):
+    """
+    A batch of operations to be sent to the server by a `BulkWriter` in a single submitTransaction call, along
+    with the earlier batches that touch the same records (which must succeed before this one is sent).
+    """
+
+    def __init__(self):
+        self.operations = []
+        self.records = set()
+        self.size = 0
+        self.dependencies = set()
+        self.failures = []
+        self.finished = False
+
+    def add(self, operations, size):
+        self.operations += operations
+        self.records.update((op["table"], op["id"]) for op in operations)
+        self.size += size
+
+
+class BulkWriter(object):
+    """
+    Submits a large number of operations to the server, split into batches of at most `max_ops` operations (and
+    roughly `max_bytes` bytes). While the writer is active (as a context manager), anything passed to the client's
+    `submit_transaction` (e.g. by `Collection.add_row`) goes through it too.
+
+    Batches are sent as soon as they fill up, with up to `concurrency` in flight at once, except that a batch
+    that touches a record that an earlier batch also touched waits for that one to succeed first, so operations
+    on any given record are always applied in order. The operations passed in a single call to `submit` (e.g. all
+    those from one transaction) are kept in the same batch, unless they won't fit in one. Batches that fail are
+    retried up to `retries` times, split in half each time in case they were rejected for being too large.
+
+    Operations are applied to the local record store as they're submitted, rather than once they've been sent.
+    Leaving the context manager (or calling `flush`) waits for all the batches to be sent, and raises a
+    `BulkWriteError` if any of them failed, after reloading the records they touched from the server (so that
+    the local store doesn't keep changes that never made it).
+    """
+
+    def __init__(
+        self, client, max_ops=200, max_bytes=1000000, concurrency=4, retries=3
+    ):
+        self.client = client
+        self.max_ops = max_ops
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.operations_submitted = 0
+        self._lock = threading.Condition(threading.RLock())
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._current = WriteBatch()
+        self._batches = []
+        self._waiting = []
+        self._last_batch = {}
+
+    def __enter__(self):
+        assert (
+            self.client._bulk_writer is None
+        ), "The client already has an active bulk writer."
+        self.client._bulk_writer = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.client._bulk_writer = None
+        try:
+            if not exc_type:
+                self.flush()
+            else:
+                # don't send anything more, but let any batches that were already sent finish
+                with self._lock:
+                    unsent = list(self._current.operations)
+                    for batch in self._waiting:
+                        batch.finished = True
+                        unsent += batch.operations
+                    self._current = WriteBatch()
+                    self._waiting = []
+                    self._lock.wait_for(self._is_idle)
+                    batches, self._batches = self._batches, []
+                failed = [
+                    op for batch in batches for ops, _ in batch.failures for op in ops
+                ]
+                self._reload_records(unsent + failed)
+        finally:
+            self._executor.shutdown(wait=False)
+
+    def submit(self, operations):
+        """
+        Queue up an operation (or list of operations) to be sent to the server.
+        """
+
+        if isinstance(operations, dict):
+            operations = [operations]
+        if not operations:
+            return
+
+        self.client._store.run_local_operations(operations)
+
+        sizes = [len(json.dumps(op)) for op in operations]
+
+        with self._lock:
+            if len(operations) > self.max_ops or sum(sizes) > self.max_bytes:
+                # too many to keep together, so let them be split up between batches
+                for op, size in zip(operations, sizes):
+                    self._add([op], size)
+            else:
+                self._add(operations, sum(sizes))
+
+    def _add(self, operations, size):
+        batch = self._current
+        if batch.operations and (
+            len(batch.operations) + len(operations) > self.max_ops
+            or batch.size + size > self.max_bytes
+        ):
+            self._close_batch()
+            batch = self._current
+        batch.add(operations, size)
+        if len(batch.operations) >= self.max_ops or batch.size >= self.max_bytes:
+            self._close_batch()
+
+    def _close_batch(self):
+        batch, self._current = self._current, WriteBatch()
+        for record in batch.records:
+            if record in self._last_batch:
+                batch.dependencies.add(self._last_batch[record])
+            self._last_batch[record] = batch
+        self._batches.append(batch)
+        self._waiting.append(batch)
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Send any batches that aren't waiting on others, and give up on any that depend on ones that failed.
+        """
+        ready = []
+        giving_up = True
+        # giving up on a batch can mean giving up on the ones waiting on it, so keep going until nothing changes
+        while giving_up:
+            giving_up = False
+            waiting = []
+            for batch in self._waiting:
+                failed = [dep for dep in batch.dependencies if dep.failures]
+                if failed:
+                    logger.warning(
+                        "Not sending a batch of {} operations, as an earlier batch failed".format(
+                            len(batch.operations)
+                        )
+                    )
+                    batch.failures = [(batch.operations, failed[0].failures[0][1])]
+                    batch.finished = True
+                    giving_up = True
+                elif all(dep.finished for dep in batch.dependencies):
+                    ready.append(batch)
+                else:
+                    waiting.append(batch)
+            self._waiting = waiting
+        self._lock.notify_all()
+
+        # only send the batches once they're no longer in the waiting list, as a batch that finishes right away
+        # runs its callback (and hence dispatches again) immediately
+        for batch in ready:
+            future = self._executor.submit(
+                self._post_batch, batch.operations, self.retries
+            )
+            future.add_done_callback(
+                lambda future, batch=batch: self._on_batch_done(batch, future)
+            )
+
+    def _on_batch_done(self, batch, future):
+        with self._lock:
+            try:
+                batch.failures = future.result()
+            except Exception as e:
+                batch.failures = [(batch.operations, e)]
+            batch.finished = True
+            self.operations_submitted += len(batch.operations) - sum(
+                len(operations) for operations, _ in batch.failures
+            )
+            self._dispatch()
+
+    def _post_batch(self, operations, retries):
+        """
+        Send a batch of operations, returning a list of (operations, exception) tuples for any that failed.
+        """
+
+        logger.debug(
+            "Submitting a batch of {} operations in bulk".format(len(operations))
+        )
+
+        try:
+            self.client.post("submitTransaction", {"operations": operations})
+            return []
+        except RequestException as e:
+            if retries <= 0:
+                return [(operations, e)]
+            logger.warning(
+                "Error submitting {} operations: {} (will retry {} more times)".format(
+                    len(operations), repr(e), retries
+                )
+            )
+            if len(operations) == 1:
+                return self._post_batch(operations, retries - 1)
+            half = (len(operations) + 1) // 2
+            failures = self._post_batch(operations[:half], retries - 1)
+            if failures:
+                # keep the operations in order, so don't send the second half if the first didn't make it
+                return failures + [(operations[half:], failures[0][1])]
+            return self._post_batch(operations[half:], retries - 1)
+
+    def _is_idle(self):
+        return all(batch.finished for batch in self._batches)
+
+    def flush(self):
+        """
+        Send any operations that are still queued up, and wait for all the batches to finish. Raises a
+        `BulkWriteError` if any operations couldn't be submitted.
+        """
+        with self._lock:
+            if self._current.operations:
+                self._close_batch()
+            self._lock.wait_for(self._is_idle)
+            batches, self._batches = self._batches, []
+            self._last_batch = {}
+        failures = [failure for batch in batches for failure in batch.failures]
+        if failures:
+            self._reload_records([op for ops, _ in failures for op in ops])
+            total = sum(len(batch.operations) for batch in batches)
+            raise BulkWriteError(failures, total)
+
+    def _reload_records(self, operations):
+        """
+        Load the records touched by operations that weren't submitted from the server again, in full, to undo
+        the changes that were made to them locally. Syncing wouldn't do, as their versions weren't bumped.
+        """
+        ids = defaultdict(set)
+        for op in operations:
+            ids[op["table"]].add(op["id"])
+        if not ids:
+            return
+        try:
+            self.client._store.call_get_record_values(
+                **{table: list(table_ids) for table, table_ids in ids.items()}
+            )
+        except Exception as e:
+            logger.warning(
+                "Couldn't reload the records from failed operations ({!r})".format(e)
+            )
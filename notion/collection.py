@@ -10,6 +10,7 @@ from .maps import property_map, field_map
 from .markdown import markdown_to_notion, notion_to_markdown
 from .operations import build_operation
 from .records import Record
+from .store import Missing
 from .utils import (
     add_signed_prefix_as_needed,
     extract_id,
@@ -134,6 +135,198 @@ class NotionSelect(object):
         return {"id": self.id, "value": self.value, "color": self.color}
 
 
+def _text_to_markdown(val):
+    # plain text (with no formatting, or characters that need special handling) comes out of notion_to_markdown
+    # unchanged, so skip parsing it
+    if all(
+        (len(item) == 1 or not item[1]) and "☃" not in item[0] and "***" not in item[0]
+        for item in val
+    ):
+        return "".join(item[0] for item in val)
+    return notion_to_markdown(val)
+
+
+def _decode_text(values, records, ids, client):
+    return [_text_to_markdown(val) if val else "" for val in values]
+
+
+def _decode_number(values, records, ids, client):
+    numbers = []
+    for val in values:
+        if val is not None:
+            val = val[0][0]
+            val = float(val) if "." in val else int(val)
+        numbers.append(val)
+    return numbers
+
+
+def _decode_select(values, records, ids, client):
+    return [val[0][0] if val else None for val in values]
+
+
+def _decode_multi_select(values, records, ids, client):
+    return [[v.strip() for v in val[0][0].split(",")] if val else [] for val in values]
+
+
+def _decode_person(values, records, ids, client):
+    user_ids = [
+        [item[1][0][1] for item in val if item[0] == "‣"] if val else []
+        for val in values
+    ]
+    client.prefetch(notion_user=[id for row_ids in user_ids for id in row_ids])
+    return [[client.get_user(id) for id in row_ids] for row_ids in user_ids]
+
+
+def _decode_plain(values, records, ids, client):
+    return [val[0][0] if val else "" for val in values]
+
+
+def _decode_date(values, records, ids, client):
+    return [NotionDate.from_notion(val) for val in values]
+
+
+def _decode_file(values, records, ids, client):
+    urls = [
+        [(item[1][0][1], id) for item in val if item[0] != ","] if val else []
+        for val, id in zip(values, ids)
+    ]
+    # signing the URLs takes a request each, so run those in parallel (if the client has `max_workers` set)
+    signed = iter(
+        client._map(
+            lambda item: add_signed_prefix_as_needed(
+                item[0], client=client, id=item[1]
+            ),
+            [item for row_urls in urls for item in row_urls],
+        )
+    )
+    return [[next(signed) for _ in row_urls] if row_urls else [] for row_urls in urls]
+
+
+def _decode_checkbox(values, records, ids, client):
+    return [val[0][0] == "Yes" if val else False for val in values]
+
+
+def _decode_relation(values, records, ids, client):
+    block_ids = [
+        [item[1][0][1] for item in val if item[0] == "‣"] if val else []
+        for val in values
+    ]
+    client.prefetch(block=[id for row_ids in block_ids for id in row_ids])
+    return [[client.get_block(id) for id in row_ids] for row_ids in block_ids]
+
+
+def _decode_time_field(field):
+    def decode(values, records, ids, client):
+        return [
+            datetime.utcfromtimestamp(record.get(field) / 1000) for record in records
+        ]
+
+    return decode
+
+
+def _decode_user_field(field):
+    def decode(values, records, ids, client):
+        user_ids = [record.get(field + "_id") for record in records]
+        client.prefetch(notion_user=[id for id in user_ids if id])
+        return [client.get_user(id) for id in user_ids]
+
+    return decode
+
+
+def _decode_raw(values, records, ids, client):
+    return list(values)
+
+
+# decoders for whole columns of property values, by property type, matching `CollectionRowBlock.get_property`
+COLUMN_DECODERS = {
+    "title": _decode_text,
+    "text": _decode_text,
+    "number": _decode_number,
+    "select": _decode_select,
+    "multi_select": _decode_multi_select,
+    "person": _decode_person,
+    "email": _decode_plain,
+    "phone_number": _decode_plain,
+    "url": _decode_plain,
+    "date": _decode_date,
+    "file": _decode_file,
+    "checkbox": _decode_checkbox,
+    "relation": _decode_relation,
+    "created_time": _decode_time_field("created_time"),
+    "last_edited_time": _decode_time_field("last_edited_time"),
+    "created_by": _decode_user_field("created_by"),
+    "last_edited_by": _decode_user_field("last_edited_by"),
+}
+
+
+class CollectionSchema(object):
+    """
+    An index of the properties in a collection's schema, for looking them up by id, slug or name without having
+    to slugify every property name on each lookup.
+    """
+
+    def __init__(self, schema):
+        self.properties = []
+        for id, item in schema.items():
+            prop = {"id": id, "slug": slugify(item["name"])}
+            prop.update(item)
+            self.properties.append(prop)
+        self.by_id = {}
+        self.by_slug = {}
+        self.by_name = {}
+        self._positions = {}
+        for position, prop in enumerate(self.properties):
+            self.by_id.setdefault(prop["id"], prop)
+            self.by_slug.setdefault(prop["slug"], prop)
+            self.by_name.setdefault(prop["name"], prop)
+            self._positions[prop["id"]] = position
+        self.title = next(
+            (prop for prop in self.properties if prop["type"] == "title"), None
+        )
+        self.slugs = [
+            prop["slug"]
+            for prop in self.properties
+            if prop["type"] not in ["formula", "rollup"]
+        ]
+        if "title" not in self.slugs:
+            self.slugs.append("title")
+        self._lookups = {}
+        self._column_decoders = None
+
+    def get_column_decoders(self):
+        """
+        Get a list of (property, decoder) tuples for decoding columns of values for each of the (non-formula/rollup)
+        properties, with the decoder for each property chosen (from `COLUMN_DECODERS`) once per schema.
+        """
+        if self._column_decoders is None:
+            self._column_decoders = [
+                (prop, COLUMN_DECODERS.get(prop["type"], _decode_raw))
+                for prop in self.properties
+                if prop["type"] not in ["formula", "rollup"]
+            ]
+        return self._column_decoders
+
+    def get(self, identifier):
+        """
+        Look up a property by id or name (slugified), or "title" for the title property. If there are several
+        matches, the first one in the schema wins.
+        """
+        if identifier not in self._lookups:
+            matches = [
+                self.by_id.get(identifier),
+                self.by_slug.get(slugify(identifier)),
+            ]
+            if identifier == "title":
+                matches.append(self.title)
+            matches = [prop for prop in matches if prop is not None]
+            self._lookups[identifier] = (
+                min(matches, key=lambda prop: self._positions[prop["id"]])
+                if matches
+                else None
+            )
+        return self._lookups[identifier]
+
+
 class Collection(Record):
     """
     A "collection" corresponds to what's sometimes called a "database" in the Notion UI.
@@ -159,17 +352,26 @@ class Collection(Record):
             self._templates = Templates(parent=self)
         return self._templates
 
+    def _get_schema_index(self):
+        """
+        Get the compiled index of the collection's schema, which is only rebuilt when the schema (or the
+        collection's version) has changed since it was last built. It's kept in the client's record store, so it's
+        shared by all instances for the collection, and dropped when the collection's record is.
+        """
+        schema = self.get("schema")
+        version = self.get("version")
+        indexes = self._client._store._schema_indexes
+        cached = indexes.get(self.id)
+        if cached is None or cached[0] is not schema or cached[1] != version:
+            cached = (schema, version, CollectionSchema(schema or {}))
+            indexes[self.id] = cached
+        return cached[2]
+
     def get_schema_properties(self):
         """
         Fetch a flattened list of all properties in the collection's schema.
         """
-        properties = []
-        schema = self.get("schema")
-        for id, item in schema.items():
-            prop = {"id": id, "slug": slugify(item["name"])}
-            prop.update(item)
-            properties.append(prop)
-        return properties
+        return list(self._get_schema_index().properties)
 
     def check_schema_select_options(self, prop, values):
         """
@@ -190,12 +392,7 @@ class Collection(Record):
         Look up a property in the collection's schema, by "property id" (generally a 4-char string),
         or name (human-readable -- there may be duplicates, so we pick the first match we find).
         """
-        for prop in self.get_schema_properties():
-            if identifier == prop["id"] or slugify(identifier) == prop["slug"]:
-                return prop
-            if identifier == "title" and prop["type"] == "title":
-                return prop
-        return None
+        return self._get_schema_index().get(identifier)
 
     def add_row(self, update_views=True, **kwargs):
         """
@@ -218,6 +415,78 @@ class Collection(Record):
 
         return row
 
+    def add_rows(self, rows, batch_size=100, update_views=True):
+        """
+        Create a new CollectionRowBlock for each dict of property values in `rows` (which can be any iterable, so
+        rows can be streamed in from a large dataset), and return a list of the new instances. The rows are created
+        in transactions of `batch_size` rows, with the new rows appended to each view's "page_sort" once per batch.
+        """
+
+        views = []
+        if update_views:
+            views = [
+                view
+                for view in self.parent.views
+                if view is not None and not isinstance(view, CalendarView)
+            ]
+
+        new_rows = []
+        batch = []
+        for values in rows:
+            batch.append(values)
+            if len(batch) >= batch_size:
+                new_rows += self._add_row_batch(batch, views)
+                batch = []
+        if batch:
+            new_rows += self._add_row_batch(batch, views)
+
+        return new_rows
+
+    def _add_row_batch(self, batch, views):
+
+        rows = []
+        operations = []
+        props = {}
+        updated_props = {}
+
+        with self._client.as_atomic_transaction():
+
+            for values in batch:
+                row_id = self._client.create_record("block", self, type="page")
+                row = CollectionRowBlock(self._client, row_id)
+                rows.append(row)
+                for identifier, val in values.items():
+                    if identifier not in props:
+                        props[identifier] = self.get_schema_property(identifier)
+                    prop = props[identifier]
+                    if prop is None:
+                        raise AttributeError(
+                            "Object does not have property '{}'".format(identifier)
+                        )
+                    if prop["type"] in ["select", "multi_select"]:
+                        schema_update, prop = self.check_schema_select_options(
+                            prop, val
+                        )
+                        if schema_update:
+                            updated_props[prop["id"]] = prop
+                    path, val = row._convert_python_to_notion(
+                        val, prop, identifier=identifier
+                    )
+                    operations.append(build_operation(id=row_id, path=path, args=val))
+
+            # (the "last edited" fields get updated when the transaction is submitted as a whole)
+            self._client.submit_transaction(operations, update_last_edited=False)
+
+            for prop in updated_props.values():
+                self.set("schema.{}.options".format(prop["id"]), prop["options"])
+
+            # make sure the new records are inserted at the end of each view
+            row_ids = [row.id for row in rows]
+            for view in views:
+                view.set("page_sort", view.get("page_sort", []) + row_ids)
+
+        return rows
+
     @property
     def parent(self):
         assert self.get("parent_table") == "block"
@@ -240,6 +509,16 @@ class Collection(Record):
     def get_rows(self, **kwargs):
         return self.query(**kwargs)
 
+    def iter_rows(self, page_size=100, **kwargs):
+        """
+        Generator that yields the rows matching the query (by default, all rows in the collection) a page of
+        `page_size` rows at a time, instead of loading them all before returning. See `CollectionQuery.iter_rows`.
+        """
+        kwargs.setdefault("limit", -1)
+        return CollectionQuery(
+            self, self._get_a_collection_view(), space_id=self.get("space_id"), **kwargs
+        ).iter_rows(page_size=page_size)
+
     def _convert_diff_to_changelist(self, difference, old_val, new_val):
 
         changes = []
@@ -385,11 +664,8 @@ class CollectionQuery(object):
         self.limit = limit
         self._client = collection._client
 
-    def execute(self):
-
-        result_class = QUERY_RESULT_TYPES.get(self.type, QueryResult)
-
-        kwargs = {
+    def _get_query_kwargs(self, limit):
+        return {
             'collection_id':self.collection.id,
             'collection_view_id':self.collection_view.id,
             'space_id':self.space_id,
@@ -401,9 +677,15 @@ class CollectionQuery(object):
             'sort':self.sort,
             'calendar_by':self.calendar_by,
             'group_by':self.group_by,
-            'limit':0
+            'limit':limit
         }
 
+    def execute(self):
+
+        result_class = QUERY_RESULT_TYPES.get(self.type, QueryResult)
+
+        kwargs = self._get_query_kwargs(limit=0)
+
         if self.limit == -1:
             # fetch remote total
             result = self._client.query_collection(
@@ -421,6 +703,70 @@ class CollectionQuery(object):
             self,
         )
 
+    def iter_rows(self, page_size=100):
+        """
+        Generator that yields the rows matching the query as CollectionRowBlock instances, up to `limit` rows
+        (or all of them, if `limit` is -1), storing and yielding them a page of `page_size` rows at a time.
+
+        The queryCollection endpoint has no offset or cursor, so the first page is requested on its own, and
+        the rest of the results are then requested in the background, while the first page is being processed.
+        The records for those remaining rows are stored one page at a time, as they're yielded, rather than
+        in a single giant update of the local store.
+        """
+
+        result_class = QUERY_RESULT_TYPES.get(self.type, QueryResult)
+        store = self._client._store
+
+        first_limit = page_size if self.limit == -1 else min(page_size, self.limit)
+        result = result_class(
+            self.collection,
+            store.call_query_collection(**self._get_query_kwargs(limit=first_limit)),
+            self,
+        )
+
+        total = result.total if self.limit == -1 else min(result.total, self.limit)
+        if total == -1 and len(result) >= first_limit:
+            logger.warning(
+                "Query for collection {} didn't report a total, so only the first {} rows were loaded".format(
+                    self.collection.id, len(result)
+                )
+            )
+
+        # start fetching the remaining results, so that it overlaps with the first page being processed
+        remaining = None
+        if total > len(result):
+            remaining = self._client._submit(
+                store._post_query_collection, **self._get_query_kwargs(limit=total)
+            )
+
+        for row in result:
+            yield row
+
+        if remaining is None:
+            return
+
+        response = remaining.result()
+        recordmap = response["recordMap"]
+        seen_ids = set(result._block_ids)
+        result = result_class(self.collection, response["result"], self)
+        row_ids = [id for id in result._block_ids if id not in seen_ids]
+        seen_ids.update(row_ids)
+
+        # store everything except the rows themselves up front, then the rows a page at a time
+        row_records = recordmap.get("block", {})
+        recordmap["block"] = {
+            id: record for id, record in row_records.items() if id not in seen_ids
+        }
+        store.store_recordmap(recordmap)
+
+        for i in range(0, len(row_ids), page_size):
+            page_ids = row_ids[i : i + page_size]
+            store.store_recordmap(
+                {"block": {id: row_records[id] for id in page_ids if id in row_records}}
+            )
+            for id in page_ids:
+                yield result._get_block(id)
+
 
 class CollectionRowBlock(PageBlock):
     @property
@@ -456,10 +802,7 @@ class CollectionRowBlock(PageBlock):
             raise AttributeError("Unknown property: '{}'".format(attname))
 
     def _get_property_slugs(self):
-        slugs = [prop["slug"] for prop in self.schema]
-        if "title" not in slugs:
-            slugs.append("title")
-        return slugs
+        return list(self.collection._get_schema_index().slugs)
 
     def __dir__(self):
         return self._get_property_slugs() + super().__dir__()
@@ -569,7 +912,7 @@ class CollectionRowBlock(PageBlock):
     def get_all_properties(self):
         allprops = {}
         for prop in self.schema:
-            propid = slugify(prop["name"])
+            propid = prop["slug"]
             allprops[propid] = self.get_property(propid)
         return allprops
 
@@ -724,6 +1067,12 @@ class Templates(Children):
 
 
 class QueryResult(object):
+    """
+    The rows matching a query, as a lazy sequence: the row IDs come back with the query, but the CollectionRowBlock
+    instances are only created as they're accessed, and any row records that aren't in the local store yet are
+    loaded a batch at a time as needed.
+    """
+
     def __init__(self, collection, result, query):
         self.collection = collection
         self._client = collection._client
@@ -762,13 +1111,35 @@ class QueryResult(object):
         return len(self._block_ids)
 
     def __getitem__(self, key):
-        return list(iter(self))[key]
+        if isinstance(key, slice):
+            ids = self._block_ids[key]
+            self._client.prefetch(block=ids)
+            return [self._get_block(id) for id in ids]
+        id = self._block_ids[key]
+        if self._client._store._get("block", id) is Missing:
+            # chances are the neighboring rows will be wanted too, so load the whole batch around it
+            size = self._get_prefetch_size()
+            start = (key % len(self._block_ids)) // size * size
+            self._client.prefetch(block=self._block_ids[start : start + size])
+        return self._get_block(id)
+
+    def _get_prefetch_size(self):
+        # enough rows to keep all of the client's workers busy loading batches in parallel
+        return self._client._store.record_values_batch_size * self._client.max_workers
+
+    def _iter_blocks(self, ids):
+        size = self._get_prefetch_size()
+        for start in range(0, len(ids), size):
+            batch = ids[start : start + size]
+            self._client.prefetch(block=batch)
+            for id in batch:
+                yield self._get_block(id)
 
     def __iter__(self):
-        return iter(self._get_block(id) for id in self._block_ids)
+        return self._iter_blocks(self._block_ids)
 
     def __reversed__(self):
-        return reversed(iter(self))
+        return self._iter_blocks(self._block_ids[::-1])
 
     def __contains__(self, item):
         if isinstance(item, str):
@@ -779,6 +1150,52 @@ class QueryResult(object):
             return False
         return item_id in self._block_ids
 
+    def to_columns(self):
+        """
+        Decode the rows into a dict mapping each property's slug to a list of that property's values for all the
+        rows (in the same form as `CollectionRowBlock.get_property` returns them). Rather than instantiating each
+        row and converting its values one by one, each column is decoded in one go.
+        """
+        self._client.prefetch(block=self._block_ids)
+        records = [
+            self._client.get_record_data("block", id) or {} for id in self._block_ids
+        ]
+        columns = {}
+        index = self.collection._get_schema_index()
+        for prop, decode in index.get_column_decoders():
+            if prop["slug"] in columns:
+                continue
+            values = [
+                record.get("properties", {}).get(prop["id"]) for record in records
+            ]
+            columns[prop["slug"]] = decode(
+                values, records, self._block_ids, self._client
+            )
+        return columns
+
+    def to_records(self):
+        """
+        Decode the rows into a list of dicts (one per row) mapping each property's slug to its value, like
+        `CollectionRowBlock.get_all_properties` (but see `to_columns`).
+        """
+        columns = self.to_columns()
+        return [
+            dict(zip(columns.keys(), values)) for values in zip(*columns.values())
+        ]
+
+    def to_dataframe(self):
+        """
+        Decode the rows into a pandas DataFrame, with a column per property and indexed by the rows' IDs. Requires
+        pandas to be installed.
+        """
+        try:
+            import pandas
+        except ImportError:
+            raise ImportError(
+                "The 'pandas' package is required for `to_dataframe` (try `pip install pandas`)"
+            )
+        return pandas.DataFrame(self.to_columns(), index=list(self._block_ids))
+
 class TableQueryResult(QueryResult):
 
     _type = "table"
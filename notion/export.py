@@ -0,0 +1,461 @@
+import io
+import os
+import re
+import tempfile
+import time
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from .logger import logger
+from .markdown import notion_to_markdown, notion_to_plaintext
+from .settings import BASE_URL
+from .utils import add_signed_prefix_as_needed, extract_id
+
+# characters that can't be used in file names on some platforms
+_UNSAFE_FILENAME_REGEX = re.compile(r'[\\/:*?"<>|\s]+')
+
+# the longest page title (in characters) to use in a file name
+MAX_FILENAME_TITLE_LENGTH = 50
+
+# markdown prefixes for blocks whose title is rendered as a single prefixed paragraph
+_PREFIXES = {
+    "header": "# ",
+    "sub_header": "## ",
+    "sub_sub_header": "### ",
+    "bulleted_list": "- ",
+    "toggle": "- ",
+    "quote": "> ",
+    "callout": "> ",
+}
+
+# blocks that are rendered as list items, which aren't separated by blank lines when consecutive
+_LIST_TYPES = {"bulleted_list", "numbered_list", "to_do", "toggle"}
+
+# blocks that are just containers, whose children are rendered as if they were at the container's level
+_CONTAINER_TYPES = {"column_list", "column"}
+
+_MEDIA_TYPES = {"image", "video", "audio", "file", "pdf", "embed"}
+
+
+def _get_title(record, key="title"):
+    return (record.get("properties") or {}).get(key) or []
+
+
+def _get_text(record, key="title"):
+    title = _get_title(record, key)
+    return title[0][0] if title and title[0] else ""
+
+
+def get_page_filename(record):
+    """
+    Build the file name (without extension) used for a page's markdown file, from its title and ID.
+    """
+    title = notion_to_plaintext(_get_title(record))
+    title = _UNSAFE_FILENAME_REGEX.sub(" ", title).strip() or "Untitled"
+    return "{} {}".format(
+        title[:MAX_FILENAME_TITLE_LENGTH].strip(), record["id"].replace("-", "")
+    )
+
+
+class MarkdownExporter(object):
+    """
+    Renders pages to markdown from the records in the client's local store, streaming the output to a file-like
+    object a block at a time, rather than going through Notion's server-side export. Any records that aren't in
+    the store yet are loaded first, in one batched request per level of the page's block tree.
+
+    Sub-pages are rendered as links to the file they'd be written to by `export` (relative to the page's own
+    file), and when `recursive` is True `export` writes them (and their sub-pages, etc) out too, with the pages
+    at each level of the tree exported concurrently on the client's thread pool.
+    """
+
+    def __init__(self, client, recursive=False):
+        self._client = client
+        self._store = client._store
+        self.recursive = recursive
+
+    def _get(self, id):
+        return self._store._get("block", id) or None
+
+    def prefetch(self, page_id):
+        """
+        Make sure the blocks making up a page (but not those of its sub-pages) are in the local store.
+        """
+        level = [page_id]
+        while level:
+            self._store.prefetch(block=level)
+            children = []
+            collection_ids = []
+            for id in level:
+                record = self._get(id)
+                if not record:
+                    continue
+                if record.get("collection_id"):
+                    collection_ids.append(record["collection_id"])
+                # don't descend into sub-pages, other than the page we're exporting itself
+                if id == page_id or record.get("type") != "page":
+                    children += record.get("content") or []
+            if collection_ids:
+                self._store.prefetch(collection=collection_ids)
+            level = children
+
+    def write(self, page, out):
+        """
+        Write the markdown for a page (a Block or a block ID) to the file-like object `out`.
+        """
+        page_id = extract_id(getattr(page, "id", page))
+        self.prefetch(page_id)
+        record = self._get(page_id)
+        if not record:
+            raise ValueError("Block {} could not be loaded".format(page_id))
+        directory = get_page_filename(record)
+        title = notion_to_markdown(_get_title(record))
+        if title:
+            out.write("# {}\n\n".format(title))
+        self._write_children(record, out, "", page_id, directory)
+
+    def render(self, page):
+        """
+        Render a page (a Block or a block ID) to a string of markdown.
+        """
+        out = io.StringIO()
+        self.write(page, out)
+        return out.getvalue()
+
+    def export(self, page, directory):
+        """
+        Write a page to a markdown file in `directory` (named after the page's title and ID), returning its path.
+        If the exporter is `recursive`, sub-pages are written to a sub-directory with the same name as the file.
+        """
+        page_id = extract_id(getattr(page, "id", page))
+        level = [(page_id, directory)]
+        path = None
+        while level:
+            results = self._client._map(self._export_page, level)
+            path = path or results[0][0]
+            level = [item for _, subpages in results for item in subpages]
+        return path
+
+    def _export_page(self, item):
+        page_id, directory = item
+        self.prefetch(page_id)
+        record = self._get(page_id)
+        if not record:
+            raise ValueError("Block {} could not be loaded".format(page_id))
+        filename = get_page_filename(record)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, filename + ".md")
+        logger.debug("Exporting page {} to {}".format(page_id, path))
+        with open(path, "w", encoding="utf-8") as f:
+            self.write(page_id, f)
+        subpages = []
+        if self.recursive:
+            subdirectory = os.path.join(directory, filename)
+            subpages = [
+                (id, subdirectory)
+                for id in dict.fromkeys(self._iter_subpages(record))
+                if self._is_subpage(self._get(id), page_id)
+            ]
+        return path, subpages
+
+    def _is_subpage(self, record, page_id):
+        """
+        Check whether a page is a sub-page of `page_id` (rather than an alias of a page that lives elsewhere), i.e.
+        whether following its parents up through the blocks it's nested in (columns, toggles, etc) leads there.
+        """
+        while True:
+            if record.get("parent_table") != "block":
+                return False
+            if record.get("parent_id") == page_id:
+                return True
+            record = self._get(record.get("parent_id"))
+            if not record or record.get("type") == "page":
+                return False
+
+    def _iter_subpages(self, record):
+        for id in record.get("content") or []:
+            child = self._get(id)
+            if not child:
+                continue
+            if child.get("type") == "page":
+                yield id
+            elif child.get("type") in _CONTAINER_TYPES or child.get("content"):
+                yield from self._iter_subpages(child)
+
+    def _write_children(self, record, out, indent, page_id, directory):
+        previous = None
+        number = 0
+        for id in record.get("content") or []:
+            child = self._get(id)
+            if not child or not child.get("alive", True):
+                continue
+            block_type = child.get("type")
+            # blank lines go between blocks, except between consecutive items of the same list
+            if previous and not (block_type == previous and block_type in _LIST_TYPES):
+                out.write("\n")
+            previous = block_type
+            if block_type in _CONTAINER_TYPES:
+                self._write_children(child, out, indent, page_id, directory)
+                continue
+            number = number + 1 if block_type == "numbered_list" else 0
+            self._write_block(child, out, indent, page_id, directory, number)
+
+    def _write_block(self, record, out, indent, page_id, directory, number):
+        block_type = record.get("type")
+        children_indent = indent + "    "
+
+        if block_type == "page":
+            text = self._render_page_link(record, page_id, directory)
+            out.write(indent + text + "\n")
+            # sub-pages are written out separately
+            return
+        elif block_type == "numbered_list":
+            text = "{}. ".format(number) + notion_to_markdown(_get_title(record))
+        elif block_type == "to_do":
+            checked = _get_text(record, "checked") == "Yes"
+            text = "- [{}] ".format("x" if checked else " ")
+            text += notion_to_markdown(_get_title(record))
+        elif block_type == "code":
+            language = _get_text(record, "language").lower()
+            code = notion_to_plaintext(_get_title(record))
+            text = "```{}\n{}\n```".format(language, code)
+        elif block_type == "equation":
+            text = "$$\n{}\n$$".format(_get_text(record))
+        elif block_type == "divider":
+            text = "---"
+        elif block_type == "bookmark":
+            link = _get_text(record, "link")
+            title = notion_to_markdown(_get_title(record)) or link
+            text = "[{}]({})".format(title, link) if link else title
+        elif block_type in _MEDIA_TYPES:
+            text = self._render_media(record)
+        elif block_type == "collection_view":
+            text = self._render_collection_name(record)
+        elif block_type == "collection_view_page":
+            text = "[{}]({})".format(
+                self._render_collection_name(record),
+                BASE_URL + record["id"].replace("-", ""),
+            )
+        else:
+            text = _PREFIXES.get(block_type, "") + notion_to_markdown(
+                _get_title(record)
+            )
+
+        out.write(indent + text.replace("\n", "\n" + indent) + "\n")
+
+        if record.get("content"):
+            if block_type not in _LIST_TYPES:
+                out.write("\n")
+            self._write_children(record, out, children_indent, page_id, directory)
+
+    def _render_page_link(self, record, page_id, directory):
+        title = notion_to_markdown(_get_title(record)) or "Untitled"
+        if not self._is_subpage(record, page_id):
+            # an alias of a page that lives elsewhere, so link to it on notion.so
+            return "[{}]({})".format(title, BASE_URL + record["id"].replace("-", ""))
+        path = "{}/{}.md".format(directory, get_page_filename(record))
+        return "[{}]({})".format(title, quote(path))
+
+    def _render_collection_name(self, record):
+        collection = self._store._get("collection", record.get("collection_id"))
+        return notion_to_markdown(_get_title(collection or {}, "name"))
+
+    def _render_media(self, record):
+        source = add_signed_prefix_as_needed(
+            _get_text(record, "source"), id=record["id"]
+        )
+        caption = notion_to_markdown(_get_title(record, "caption"))
+        if not source:
+            return caption
+        if record.get("type") == "image":
+            return "![{}]({})".format(caption, source)
+        return "[{}]({})".format(caption or source, source)
+
+
+class ServerExportError(Exception):
+    """
+    Raised by a `ServerExporter` when some of the pages couldn't be exported. The `failures` attribute maps the
+    IDs of those pages to the error, and `paths` maps the IDs of the pages that were exported to their zip files.
+    """
+
+    def __init__(self, failures, paths):
+        self.failures = failures
+        self.paths = paths
+        super().__init__(
+            "Failed to export {} of {} pages (first error: {!r})".format(
+                len(failures),
+                len(failures) + len(paths),
+                next(iter(failures.values())),
+            )
+        )
+
+
+class ServerExporter(object):
+    """
+    Exports pages through Notion's server-side export (the "exportBlock" task), many at a time. All the tasks are
+    enqueued up front, then their progress is checked with a single "getTasks" request per tick (backing off while
+    nothing finishes), and each export's zip file is streamed to disk as soon as it's ready, while the remaining
+    tasks are still being polled. Up to `concurrency` tasks are enqueued, and zip files downloaded, at once.
+    """
+
+    # the range of intervals (in seconds) to wait between polls, and the factor to back off by when nothing finished
+    poll_interval_min = 0.25
+    poll_interval_max = 5
+    poll_backoff = 1.5
+
+    # how many bytes of a zip file to download at a time
+    download_chunk_size = 1024 * 1024
+
+    def __init__(
+        self,
+        client,
+        export_type="markdown",
+        recursive=False,
+        time_zone="America/Los_Angeles",
+        locale="en",
+        timeout=1200,
+        concurrency=4,
+    ):
+        self._client = client
+        self.concurrency = concurrency
+        self.export_type = export_type
+        self.recursive = recursive
+        self.time_zone = time_zone
+        self.locale = locale
+        self.timeout = timeout
+
+    def export(self, pages, directory):
+        """
+        Export each of the pages (Blocks or block IDs), saving the zip files into `directory` (named after the page
+        IDs). Returns a dict mapping the page IDs to the paths of their zip files, or raises a `ServerExportError`
+        (after the other exports have finished) if any of them failed.
+        """
+        page_ids = [extract_id(getattr(page, "id", page)) for page in pages]
+        os.makedirs(directory, exist_ok=True)
+        paths = {
+            page_id: os.path.join(directory, page_id.replace("-", "") + ".zip")
+            for page_id in page_ids
+        }
+        tasks = {}
+        downloads = {}
+        failures = {}
+
+        with ThreadPoolExecutor(max_workers=max(self.concurrency, 1)) as executor:
+
+            enqueued = [
+                (page_id, executor.submit(self._enqueue_task, page_id))
+                for page_id in page_ids
+            ]
+            for page_id, future in enqueued:
+                try:
+                    tasks[future.result()] = page_id
+                except Exception as e:
+                    failures[page_id] = e
+            logger.debug("Enqueued {} export tasks".format(len(tasks)))
+
+            for task_id, result in self._wait_for_tasks(list(tasks)):
+                page_id = tasks[task_id]
+                if isinstance(result, Exception):
+                    failures[page_id] = result
+                else:
+                    downloads[page_id] = executor.submit(
+                        self._download, result, paths[page_id]
+                    )
+
+            for page_id, download in downloads.items():
+                try:
+                    download.result()
+                except Exception as e:
+                    failures[page_id] = e
+
+        if failures:
+            raise ServerExportError(
+                failures,
+                {id: path for id, path in paths.items() if id not in failures},
+            )
+        return paths
+
+    def extract_markdown(self, page):
+        """
+        Export a single page, returning the contents of the markdown file inside the zip.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.export([page], directory).popitem()[1]
+            with zipfile.ZipFile(path) as z:
+                names = z.namelist()
+                assert len(names) == 1, "Expected exactly one file in the zip"
+                with z.open(names[0]) as f:
+                    return f.read().decode("utf-8")
+
+    def _enqueue_task(self, page_id):
+        space_id = (self._client._store._get("block", page_id) or {}).get("space_id")
+        request = {
+            "block": {
+                "id": page_id,
+                "spaceId": space_id or self._client.current_space.id,
+            },
+            "recursive": self.recursive,
+            "exportOptions": {
+                "exportType": self.export_type,
+                "timeZone": self.time_zone,
+                "locale": self.locale,
+                "collectionViewExportType": "currentView",
+                "includeContents": "no_files",
+                "preferredViewMap": {},
+            },
+            "shouldExportComments": False,
+        }
+        data = {"task": {"eventName": "exportBlock", "request": request}}
+        return self._client.post("enqueueTask", data).json()["taskId"]
+
+    def _wait_for_tasks(self, task_ids):
+        """
+        Poll the tasks until they've all finished, yielding (task ID, export URL or exception) tuples as they do.
+        """
+        pending = set(task_ids)
+        interval = self.poll_interval_min
+        deadline = time.time() + self.timeout
+        while pending:
+            if time.time() > deadline:
+                for task_id in pending:
+                    yield task_id, TimeoutError(
+                        "Export task {} timed out".format(task_id)
+                    )
+                return
+            results = self._client.post("getTasks", {"taskIds": list(pending)}).json()
+            finished = 0
+            for result in results["results"]:
+                task_id = result.get("id")
+                if task_id not in pending:
+                    continue
+                if result.get("state") == "success":
+                    yield task_id, result["status"]["exportURL"]
+                elif result.get("state") == "failure":
+                    yield task_id, RuntimeError(
+                        "Export task {} failed: {}".format(task_id, result.get("error"))
+                    )
+                else:
+                    continue
+                pending.discard(task_id)
+                finished += 1
+            if not pending:
+                break
+            if finished:
+                interval = self.poll_interval_min
+            else:
+                interval = min(interval * self.poll_backoff, self.poll_interval_max)
+            time.sleep(interval)
+
+    def _download(self, url, path):
+        """
+        Stream a file to disk (via a temporary file, so that there's never a partial file at `path`).
+        """
+        tmp_path = path + ".part"
+        with self._client.session.get(url, stream=True) as response:
+            response.raise_for_status()
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(self.download_chunk_size):
+                    f.write(chunk)
+        os.replace(tmp_path, path)
+        return path
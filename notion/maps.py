@@ -1,7 +1,15 @@
+from collections import OrderedDict
 from inspect import signature
 
 from .logger import logger
 from .markdown import markdown_to_notion, notion_to_markdown
+from .utils import get_by_path
+
+# the maximum number of converted values to remember for each mapped attribute
+MEMOIZE_SIZE = 10000
+
+# types of converted values that can safely be handed out more than once
+IMMUTABLE_TYPES = (str, int, float, bool, type(None))
 
 
 class mapper(property):
@@ -33,19 +41,40 @@ def field_map(path, python_to_api=lambda x: x, api_to_python=lambda x: x):
     if isinstance(path, str):
         path = path.split(".")
 
+    # work out what the converters accept up front, rather than on every access
+    api_params = signature(api_to_python).parameters
+    pass_client_to_getter = "client" in api_params and "id" in api_params
+    pass_client_to_setter = "client" in signature(python_to_api).parameters
+
+    # converted values are remembered per record, as long as the record's version and the raw value are unchanged,
+    # except for converters that use the client (e.g. to look up other records), whose results could change
+    memoize = not pass_client_to_getter or not getattr(
+        api_to_python, "uses_client", True
+    )
+    memo = OrderedDict()
+
     def fget(self):
-        kwargs = {}
-        if (
-            "client" in signature(api_to_python).parameters
-            and "id" in signature(api_to_python).parameters
-        ):
-            kwargs["client"] = self._client
-            kwargs["id"] = self.id
-        return api_to_python(self.get(path), **kwargs)
+        data = self._get_record_data()
+        raw = get_by_path(path, data)
+        if not memoize:
+            return api_to_python(raw, client=self._client, id=self.id)
+        version = data.get("version") if data else None
+        cached = memo.get(self.id)
+        if cached and cached[0] == version and cached[1] is raw:
+            return cached[2]
+        kwargs = (
+            {"client": self._client, "id": self.id} if pass_client_to_getter else {}
+        )
+        value = api_to_python(raw, **kwargs)
+        if isinstance(value, IMMUTABLE_TYPES):
+            memo[self.id] = (version, raw, value)
+            while len(memo) > MEMOIZE_SIZE:
+                memo.popitem(last=False)
+        return value
 
     def fset(self, value):
         kwargs = {}
-        if "client" in signature(python_to_api).parameters:
+        if pass_client_to_setter:
             kwargs["client"] = self._client
         self.set(path, python_to_api(value, **kwargs))
 
@@ -69,9 +98,12 @@ def property_map(
     this representation into commonmark-compatible markdown, and back again when saving.
     """
 
+    python_params = signature(python_to_api).parameters
+    api_params = signature(api_to_python).parameters
+
     def py2api(x, client=None):
         kwargs = {}
-        if "client" in signature(python_to_api).parameters:
+        if "client" in python_params:
             kwargs["client"] = client
         x = python_to_api(x, **kwargs)
         if markdown:
@@ -83,13 +115,15 @@ def property_map(
         if markdown:
             x = notion_to_markdown(x)
         kwargs = {}
-        params = signature(api_to_python).parameters
-        if "client" in params:
+        if "client" in api_params:
             kwargs["client"] = client
-        if "id" in params:
+        if "id" in api_params:
             kwargs["id"] = id
         return api_to_python(x, **kwargs)
 
+    # lets `field_map` know whether the result depends on the client and record id, or just the value
+    api2py.uses_client = "client" in api_params or "id" in api_params
+
     return field_map(["properties", name], python_to_api=py2api, api_to_python=api2py)
 
 
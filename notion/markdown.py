@@ -1,6 +1,9 @@
 import commonmark
+import json
 import re
 import html
+from collections import OrderedDict
+from threading import Lock
 from xml.dom import minidom
 
 from commonmark.dump import prepare
@@ -75,6 +78,60 @@ _NOTION_TO_MARKDOWN_MAPPER = {"i": "☃", "b": "☃☃", "s": "~~", "c": "`", "e
 
 FORMAT_PRECEDENCE = ["s", "b", "i", "a", "c", "e"]
 
+# the number of recent conversions to remember, in each direction
+CONVERSION_CACHE_SIZE = 4096
+
+
+class ConversionCache(object):
+    """
+    A bounded, thread-safe cache of recent conversion results, which discards the least recently used ones.
+    """
+
+    def __init__(self, maxsize=CONVERSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_markdown_to_notion_cache = ConversionCache()
+_notion_to_markdown_cache = ConversionCache()
+
+# characters with a special meaning in markdown (or to the pre-processing in `_markdown_to_notion`)
+_SPECIAL_CHARS = "\\`*_[]<>&~$⸻\n\r\x00"
+_PLAIN_CHARS = "[^{}]".format(re.escape(_SPECIAL_CHARS))
+_PLAIN_TEXT_REGEX = re.compile("{}*".format(_PLAIN_CHARS))
+
+# text that would be parsed as the start of a heading or list
+_BLOCK_START_REGEX = re.compile(r"(#{1,6}|\+|\d{1,9}[.)])(\s|$)")
+
+# the simple kinds of inline formatting that `_simple_markdown_to_notion` handles, around plain text that starts
+# and ends with an alphanumeric character
+_SIMPLE_TEXT = r"[^\W_](?:{}*[^\W_])?".format(_PLAIN_CHARS)
+_SIMPLE_FORMAT_REGEX = re.compile(
+    r"\*\*(?P<b>{text})\*\*|\*(?P<i>{text})\*|`(?P<c>{text})`|~~(?P<s>{text})~~"
+    r"|\[(?P<a>{text})\]\((?P<url>[A-Za-z0-9:/.?=#+,;@_-]+)\)".format(
+        text=_SIMPLE_TEXT
+    )
+)
+
 
 def _extract_text_and_format_from_ast(item):
 
@@ -116,11 +173,81 @@ def _get_format(notion_segment, as_set=False):
             return notion_segment[1]
 
 
+def _copy_notion(notion):
+    copied = []
+    for item in notion:
+        if len(item) > 1:
+            copied.append([item[0], [list(f) for f in item[1]]])
+        else:
+            copied.append([item[0]])
+    return copied
+
+
+def _simple_markdown_to_notion(markdown):
+    """
+    Convert markdown that's either plain text, or only uses simple (non-nested) bold, italic, code, strikethrough
+    and link formatting, in a single pass, without the full parser. Returns None for anything more complex.
+    """
+
+    if not markdown:
+        return []
+
+    if (
+        markdown != markdown.strip()
+        or _BLOCK_START_REGEX.match(markdown)
+        or "%E2%B8%BB" in markdown
+    ):
+        return None
+
+    notion = []
+    pos = 0
+    for match in _SIMPLE_FORMAT_REGEX.finditer(markdown):
+        text = markdown[pos : match.start()]
+        # the text in between has to be plain, and is required between formatted spans to avoid ambiguity
+        if (
+            not _PLAIN_TEXT_REGEX.fullmatch(text)
+            or (notion and not text)
+            or text.endswith("!")
+        ):
+            return None
+        if text:
+            notion.append([text])
+        kind = match.lastgroup
+        if kind == "url":
+            notion.append([match.group("a"), [["a", match.group("url")]]])
+        else:
+            notion.append([match.group(kind), [[kind]]])
+        pos = match.end()
+
+    text = markdown[pos:]
+    if not _PLAIN_TEXT_REGEX.fullmatch(text):
+        return None
+    if text:
+        notion.append([text])
+
+    return notion
+
+
 def markdown_to_notion(markdown):
 
     if not isinstance(markdown, str):
         markdown = str(markdown)
 
+    # most text is plain (or simply formatted), so try converting it directly before parsing it properly
+    notion = _simple_markdown_to_notion(markdown)
+    if notion is not None:
+        return notion
+
+    # the results are lists, which the caller could modify, so hand out copies of the cached version
+    notion = _markdown_to_notion_cache.get(markdown)
+    if notion is None:
+        notion = _markdown_to_notion(markdown)
+        _markdown_to_notion_cache.set(markdown, notion)
+    return _copy_notion(notion)
+
+
+def _markdown_to_notion(markdown):
+
     # commonmark doesn't support strikethrough, so we need to handle it ourselves
     while markdown.count("~~") >= 2:
         markdown = markdown.replace("~~", "<s>", 1)
@@ -218,6 +345,20 @@ def cleanup_dashes(thing):
 
 def notion_to_markdown(notion):
 
+    try:
+        key = json.dumps(notion, separators=(",", ":"))
+    except TypeError:
+        return _notion_to_markdown(notion)
+
+    markdown = _notion_to_markdown_cache.get(key)
+    if markdown is None:
+        markdown = _notion_to_markdown(notion)
+        _notion_to_markdown_cache.set(key, markdown)
+    return markdown
+
+
+def _notion_to_markdown(notion):
+
     markdown_chunks = []
 
     use_underscores = True
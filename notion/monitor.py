@@ -23,6 +23,7 @@ class Monitor(object):
         self.session_id = str(uuid.uuid4())
         self.root_url = root_url
         self._subscriptions = set()
+        self._subscribed_keys = set()
         self.initialize()
 
     def _decode_numbered_json_thing(self, thing):
@@ -89,6 +90,7 @@ class Monitor(object):
 
                 # add the record to the list of records to restore if we're disconnected
                 self._subscriptions.add(record)
+                self._subscribed_keys.add((record._table, record.id))
 
                 # subscribe to changes to the record itself
                 sub_data.append(
@@ -115,6 +117,9 @@ class Monitor(object):
 
         self.post_data(data)
 
+    def is_subscribed(self, table, id):
+        return (table, id) in self._subscribed_keys
+
     def post_data(self, data):
 
         if not data:
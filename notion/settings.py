@@ -2,7 +2,8 @@ import os
 from pathlib import Path
 
 BASE_URL = "https://www.notion.so/"
-API_BASE_URL = BASE_URL + "api/v3/"
+# can be overridden, e.g. to point the client at a local stub server for testing
+API_BASE_URL = os.environ.get("NOTION_API_BASE_URL", BASE_URL + "api/v3/")
 SIGNED_URL_PREFIX = "https://www.notion.so/signed/"
 S3_URL_PREFIX = "https://s3-us-west-2.amazonaws.com/secure.notion-static.com/"
 S3_URL_PREFIX_ENCODED = "https://s3.us-west-2.amazonaws.com/secure.notion-static.com/"
@@ -1,16 +1,20 @@
 import datetime
 import json
+import logging
 import threading
+import time
 import uuid
 
-from collections import defaultdict
-from copy import deepcopy
+from collections import defaultdict, OrderedDict
+from copy import copy
 from dictdiffer import diff
 from inspect import signature
-from threading import Lock
+from threading import Lock, RLock
 from pathlib import Path
+from requests import RequestException
 from tzlocal import get_localzone
 
+from .cache import RecordCache
 from .logger import logger
 from .settings import CACHE_DIR
 from .utils import extract_id
@@ -73,22 +77,225 @@ class Callback(object):
             return False
 
 
+class PendingLoad(object):
+    """
+    Tracks a request to load one or more records from the server, so that other threads that need the same
+    records can wait for it to complete, rather than issuing a duplicate request of their own.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.error = None
+        self._done = threading.Event()
+
+    def finish(self, error=None):
+        self.error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class RecordTable(OrderedDict):
+    """
+    The records for a single table in the store, kept in least-recently-used order, so that when the store has
+    bounds on the number (or approximate total size) of records per table, the least recently used ones can be
+    evicted to stay within them. Records that the store considers pinned (see `RecordStore._is_pinned`) are
+    never evicted.
+
+    Changes to the table are serialized by its own lock, but reads don't take it, so they never wait.
+    """
+
+    def __init__(self, store, table):
+        super().__init__()
+        self._store = store
+        self._table = table
+        self._lock = RLock()
+        self._sizes = {}
+        self._total_size = 0
+
+    def get(self, id, default=None):
+        try:
+            value = self[id]
+            self.move_to_end(id)
+        except KeyError:
+            return default
+        return value
+
+    def setdefault(self, id, default=None):
+        with self._lock:
+            value = self.get(id, Missing)
+            if value is Missing:
+                self[id] = value = default
+            return value
+
+    def __setitem__(self, id, value):
+        size = len(json.dumps(value)) if self._store.max_bytes_per_table else 0
+        with self._lock:
+            super().__setitem__(id, value)
+            self.move_to_end(id)
+            self._total_size += size - self._sizes.get(id, 0)
+            self._sizes[id] = size
+            self._evict()
+
+    def __delitem__(self, id):
+        with self._lock:
+            super().__delitem__(id)
+            self._total_size -= self._sizes.pop(id, 0)
+
+    def pop(self, id, *default):
+        with self._lock:
+            if id not in self:
+                if default:
+                    return default[0]
+                raise KeyError(id)
+            value = self[id]
+            del self[id]
+            return value
+
+    def _over_limit(self):
+        max_records = self._store.max_records_per_table
+        max_bytes = self._store.max_bytes_per_table
+        return (max_records and len(self) > max_records) or (
+            max_bytes and self._total_size > max_bytes
+        )
+
+    def _evict(self):
+        # pinned records are moved to the end as they're encountered, so give up after one full pass
+        for _ in range(len(self)):
+            if not self._over_limit():
+                break
+            id = next(iter(self))
+            if self._store._is_pinned(self._table, id):
+                self.move_to_end(id)
+                continue
+            logger.debug("Evicting {}/{} from the record store".format(self._table, id))
+            del self[id]
+            self._store._role[self._table].pop(id, None)
+            if self._table == "collection":
+                self._store._schema_indexes.pop(id, None)
+
+
+class RecordTables(dict):
+    def __init__(self, store):
+        super().__init__()
+        self._store = store
+
+    def __missing__(self, table):
+        return super().setdefault(table, RecordTable(self._store, table))
+
+
 class RecordStore(object):
-    def __init__(self, client, cache_key=None):
+
+    # the maximum number of records to request in a single call to the getRecordValues endpoint
+    record_values_batch_size = 100
+
+    # how many times to retry a failed batch of getRecordValues requests (splitting it in half each time)
+    record_values_retries = 3
+
+    # how long (in seconds) to wait for other records to be requested, so that they can all be loaded together
+    coalesce_window = 0.005
+
+    # the number of locks that records are spread across, to serialize updates to any individual record
+    lock_stripes = 64
+
+    def __init__(
+        self,
+        client,
+        cache_key=None,
+        max_records_per_table=None,
+        max_bytes_per_table=None,
+    ):
+        """
+        If `max_records_per_table` or `max_bytes_per_table` (approximate, based on the records' JSON size) are set,
+        the least recently used records beyond those bounds are evicted from memory (except for those that have
+        callbacks registered or are being monitored), to be reloaded from the disk cache or server when next needed.
+        """
+        # guards the set of records waiting to be written to the on-disk cache, and the pinned record counts
         self._mutex = Lock()
+        self._record_locks = [RLock() for _ in range(self.lock_stripes)]
         self._client = client
         self._cache_key = cache_key
-        self._values = defaultdict(lambda: defaultdict(dict))
+        self.max_records_per_table = max_records_per_table
+        self.max_bytes_per_table = max_bytes_per_table
+        self._values = RecordTables(self)
         self._role = defaultdict(lambda: defaultdict(str))
         self._collection_row_ids = {}
+        # compiled collection schemas, keyed by collection id (see `Collection._get_schema_index`), which are
+        # dropped along with the collection's record
+        self._schema_indexes = {}
         self._callbacks = defaultdict(lambda: defaultdict(list))
         self._records_to_refresh = {}
         self._pages_to_refresh = []
+        self._dirty = set()
+        # records that are being loaded (and so mustn't be evicted yet), with how many loads each is part of
+        self._pinned = defaultdict(int)
+        self._loads_mutex = Lock()
+        self._pending_loads = {}
+        self._open_batch = None
+        self._cache = (
+            RecordCache(self._get_cache_path("_records", extension="log"))
+            if cache_key
+            else None
+        )
         with self._mutex:
             self._load_cache()
 
     def _get(self, table, id):
-        return self._values[table].get(id, Missing)
+        value = self._values[table].get(id, Missing)
+        if value is Missing and self._cache is not None and (table, id) in self._cache:
+            value = self._load_from_cache(table, id)
+        return value
+
+    def _load_from_cache(self, table, id):
+        """
+        Deserialize a record from the on-disk cache into memory, the first time it's needed.
+        """
+        payload = self._cache.read(table, id)
+        if not payload:
+            return Missing
+        # don't clobber anything that was loaded from the server while we were reading from disk
+        if payload.get("role"):
+            self._role[table].setdefault(id, payload["role"])
+        return self._values[table].setdefault(id, payload["value"])
+
+    def _lock_for(self, table, id):
+        """
+        Get the lock that guards updates to a record. Reading a record doesn't require holding it.
+        """
+        return self._record_locks[hash((table, id)) % len(self._record_locks)]
+
+    def _mark_dirty(self, table, id):
+        if self._cache is not None:
+            with self._mutex:
+                self._dirty.add((table, id))
+
+    def _pin(self, keys):
+        """
+        Keep the records with the specified (table, id) keys from being evicted, until they're passed to `_unpin`.
+        """
+        with self._mutex:
+            for key in keys:
+                self._pinned[key] += 1
+
+    def _unpin(self, keys):
+        with self._mutex:
+            for key in keys:
+                self._pinned[key] -= 1
+                if not self._pinned[key]:
+                    del self._pinned[key]
+
+    def _is_pinned(self, table, id):
+        """
+        Determine whether a record needs to be kept in memory, so it can't be evicted.
+        """
+        key = (table, id)
+        if self._callbacks[table].get(id) or key in self._dirty or key in self._pinned:
+            return True
+        monitor = getattr(self._client, "_monitor", None)
+        return monitor is not None and monitor.is_subscribed(table, id)
 
     def add_callback(self, record, callback, callback_id=None, extra_kwargs={}):
         assert callable(
@@ -112,24 +319,46 @@ class RecordStore(object):
         while callback_or_callback_id_prefix in callbacks:
             callbacks.remove(callback_or_callback_id_prefix)
 
-    def _get_cache_path(self, attribute):
+    def _get_cache_path(self, attribute, extension="json"):
         return str(
-            Path(CACHE_DIR).joinpath("{}{}.json".format(self._cache_key, attribute))
+            Path(CACHE_DIR).joinpath(
+                "{}{}.{}".format(self._cache_key, attribute, extension)
+            )
         )
 
-    def _load_cache(self, attributes=("_values", "_role", "_collection_row_ids")):
+    def _load_cache(self):
         if not self._cache_key:
             return
-        for attr in attributes:
+        # records are only indexed here; they get deserialized lazily, as they're accessed (see `_get`)
+        self._cache.open()
+        if not len(self._cache):
+            self._load_legacy_cache()
+        try:
+            with open(self._get_cache_path("_collection_row_ids")) as f:
+                self._collection_row_ids.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def _load_legacy_cache(self):
+        """
+        Import data from the old format of cache files (one JSON file per attribute, rewritten in full on each
+        update) into the record log, so that existing caches keep working.
+        """
+        for attr in ("_values", "_role"):
             try:
                 with open(self._get_cache_path(attr)) as f:
-                    if attr == "_collection_row_ids":
-                        self._collection_row_ids.update(json.load(f))
-                    else:
-                        for k, v in json.load(f).items():
-                            getattr(self, attr)[k].update(v)
+                    for k, v in json.load(f).items():
+                        getattr(self, attr)[k].update(v)
             except (FileNotFoundError, ValueError):
                 pass
+        self._cache.write(
+            [
+                (table, id, value, self._role[table].get(id))
+                for table, records in self._values.items()
+                for id, value in records.items()
+                if value
+            ]
+        )
 
     def set_collection_rows(self, collection_id, row_ids):
 
@@ -166,6 +395,35 @@ class RecordStore(object):
         with open(self._get_cache_path(attribute), "w") as f:
             json.dump(getattr(self, attribute), f)
 
+    def _flush_cache(self):
+        """
+        Append any records that have changed since the last flush to the on-disk record log.
+        """
+        if self._cache is None:
+            return
+        with self._mutex:
+            dirty, self._dirty = self._dirty, set()
+        records = []
+        for table, id in dirty:
+            # wait for any update that's still in progress on the record, so the latest value gets written
+            with self._lock_for(table, id):
+                records.append(
+                    (table, id, self._values[table].get(id), self._role[table].get(id))
+                )
+        self._cache.write(records)
+
+    def remove_record(self, table, id):
+        """
+        Remove a record from the local store (and the on-disk cache, if enabled).
+        """
+        with self._lock_for(table, id):
+            self._mark_dirty(table, id)
+            self._values[table].pop(id, None)
+            self._role[table].pop(id, None)
+            if table == "collection":
+                self._schema_indexes.pop(id, None)
+        self._flush_cache()
+
     def _trigger_callbacks(self, table, id, difference, old_val, new_val):
         for callback_obj in self._callbacks[table][id]:
             callback_obj(difference, old_val, new_val)
@@ -180,38 +438,164 @@ class RecordStore(object):
         result = self._get(table, id)
         # if it's not found, try refreshing the record from the server
         if result is Missing or force_refresh:
-            if table == "block":
-                self.call_load_page_chunk(id,limit=limit)
-            else:
-                self.call_get_record_values(**{table: id})
-            result = self._get(table, id)
+            # make sure the record isn't evicted (e.g. by the rest of its page being loaded) before we can read it
+            self._pin([(table, id)])
+            try:
+                self._load_record(table, id, limit=limit)
+                result = self._get(table, id)
+            finally:
+                self._unpin([(table, id)])
         return result if result is not Missing else None
 
-    def _update_record(self, table, id, value=None, role=None):
+    def _load_record(self, table, id, limit=100):
+        """
+        Load a record from the server. If the same record is already being loaded by another thread, this just
+        waits for that request to complete, rather than sending another one.
+        """
+
+        if self._client.in_transaction():
+            self._call_load_records([(table, id)], limit=limit)
+            return
+
+        key = (table, id)
+        with self._loads_mutex:
+            pending = self._pending_loads.get(key)
+            leader = pending is None
+            if leader:
+                pending = self._pending_loads[key] = PendingLoad()
+
+        if not leader:
+            logger.debug("Waiting for in-flight load of {}/{}".format(table, id))
+            pending.wait()
+            return
+
+        try:
+            if self.coalesce_window > 0:
+                self._load_coalesced(key, limit=limit)
+            else:
+                self._call_load_records([key], limit=limit)
+        except Exception as e:
+            pending.finish(error=e)
+            raise
+        else:
+            pending.finish()
+        finally:
+            with self._loads_mutex:
+                del self._pending_loads[key]
+
+    def _load_coalesced(self, key, limit=100):
+        """
+        Add the record to a batch of records to be loaded together. If other records are being loaded at the same
+        time, the first record added to a batch waits `coalesce_window` seconds for more to arrive, and then loads
+        them all in a single request; otherwise (e.g. in single-threaded code) it's loaded right away.
+        """
+
+        with self._loads_mutex:
+            batch = self._open_batch
+            leader = batch is None
+            if leader:
+                batch = self._open_batch = PendingLoad()
+                # our own load is always pending, so look for any others
+                concurrent = len(self._pending_loads) > 1
+            batch.keys.append(key)
+
+        if not leader:
+            batch.wait()
+            return
+
+        if concurrent:
+            time.sleep(self.coalesce_window)
+        with self._loads_mutex:
+            self._open_batch = None
+
+        try:
+            self._call_load_records(batch.keys, limit=limit)
+        except Exception as e:
+            batch.finish(error=e)
+            raise
+        else:
+            batch.finish()
+
+    def _call_load_records(self, keys, limit=100):
+        # records we already have a version of only need to be downloaded again if they've changed since
+        known = [key for key in keys if self.get_current_version(*key) >= 0]
+        if known:
+            ids = defaultdict(list)
+            for table, id in known:
+                ids[table].append(id)
+            self.call_sync_record_values(**ids)
+            known = set(known)
+            keys = [key for key in keys if key not in known]
+        if not keys:
+            return
+        if len(keys) == 1 and keys[0][0] == "block":
+            # loading a block on its own also loads (the first chunk of) its page, which usually comes in handy
+            self.call_load_page_chunk(keys[0][1], limit=limit)
+        else:
+            ids = defaultdict(list)
+            for table, id in keys:
+                ids[table].append(id)
+            self.call_get_record_values(**ids)
+
+    def _update_record(
+        self,
+        table,
+        id,
+        value=None,
+        role=None,
+        flush=True,
+        local=False,
+        changed_keys=None,
+    ):
+        """
+        Update the local copy of a record. If `flush` is False, the change is only persisted to the on-disk
+        cache on the next call to `_flush_cache`, so that bulk updates can be written out in a single batch.
+
+        Changes are only worked out (by diffing the old and new values) if there are callbacks registered for the
+        record. Values from the server with the same version as the local copy are taken to be unchanged, but
+        `local` changes (simulating operations that haven't been reflected in the version yet) are always diffed.
+        If the caller knows that only some of the top-level keys may have changed, passing them as `changed_keys`
+        limits the diff to those keys.
+        """
 
         callback_queue = []
+        old_val = None
 
-        with self._mutex:
+        with self._lock_for(table, id):
+            if role or value:
+                self._mark_dirty(table, id)
             if role:
                 logger.debug("Updating 'role' for {}/{} to {}".format(table, id, role))
                 self._role[table][id] = role
-                self._save_cache("_role")
             if value:
-                logger.debug(
-                    "Updating 'value' for {}/{} to {}".format(table, id, value)
-                )
-                old_val = self._values[table][id]
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "Updating 'value' for {}/{} to {}".format(table, id, value)
+                    )
+                if self._callbacks[table].get(id):
+                    # if it's not in memory, diff against the copy on disk (if any), so callbacks hear about it
+                    old_val = self._get(table, id) or None
+                self._values[table][id] = value
+
+        if flush:
+            self._flush_cache()
+
+        if old_val and old_val is not value:
+            if local or old_val.get("version") != value.get("version"):
+                # records are replaced rather than modified, so the diff can be done without holding the lock
+                old_part, new_part = old_val, value
+                if changed_keys is not None:
+                    old_part = {k: old_val[k] for k in changed_keys if k in old_val}
+                    new_part = {k: value[k] for k in changed_keys if k in value}
                 difference = list(
                     diff(
-                        old_val,
-                        value,
+                        old_part,
+                        new_part,
                         ignore=["version", "last_edited_time", "last_edited_by"],
                         expand=True,
                     )
                 )
-                self._values[table][id] = value
-                self._save_cache("_values")
-                if old_val and difference:
+                if difference:
                     logger.debug("Value changed! Difference: {}".format(difference))
                     callback_queue.append((table, id, difference, old_val, value))
 
@@ -233,6 +617,8 @@ class RecordStore(object):
             # ensure "ids" is a proper list
             if ids is True:
                 ids = list(self._values.get(table, {}).keys())
+                if self._cache is not None:
+                    ids = list(set(ids + self._cache.ids(table)))
             if isinstance(ids, str):
                 ids = [ids]
 
@@ -245,27 +631,230 @@ class RecordStore(object):
 
             requestlist += [{"table": table, "id": extract_id(id)} for id in ids]
 
-        if requestlist:
-            logger.debug(
-                "Calling 'getRecordValues' endpoint for requests: {}".format(
-                    requestlist
+        if not requestlist:
+            return
+
+        # split the requests into bounded batches, which are sent in parallel (if the client has `max_workers` set)
+        batch_size = self.record_values_batch_size
+        batches = [
+            requestlist[i : i + batch_size]
+            for i in range(0, len(requestlist), batch_size)
+        ]
+
+        # keep the records we've loaded from being evicted by the ones after them, until they've all been stored
+        keys = [(request["table"], request["id"]) for request in requestlist]
+        self._pin(keys)
+        try:
+            errors = []
+            for batch, results in zip(
+                batches, self._client._map(self._post_get_record_values, batches)
+            ):
+                for request, result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        errors.append(result)
+                        continue
+                    self._update_record(
+                        request["table"],
+                        request["id"],
+                        value=result.get("value"),
+                        role=result.get("role"),
+                        flush=False,
+                    )
+            self._flush_cache()
+        finally:
+            self._unpin(keys)
+
+        # the results of all the requests that succeeded have been stored, so now we can report any failures
+        if errors:
+            logger.error(
+                "Failed to load {} of {} records from 'getRecordValues'".format(
+                    len(errors), len(requestlist)
                 )
             )
-            results = self._client.post(
+            raise errors[0]
+
+    def _post_get_record_values(self, requestlist, retries=None):
+        """
+        Call the getRecordValues endpoint for a batch of requests, and return the list of results. If the call
+        fails, it's retried (up to `record_values_retries` times), splitting the batch in half each time, in case
+        it was rejected for being too large. Requests that still failed have the exception as their result.
+        """
+
+        if retries is None:
+            retries = self.record_values_retries
+
+        logger.debug(
+            "Calling 'getRecordValues' endpoint for requests: {}".format(requestlist)
+        )
+
+        try:
+            return self._client.post(
                 "getRecordValues", {"requests": requestlist}
             ).json()["results"]
-            for request, result in zip(requestlist, results):
-                self._update_record(
-                    request["table"],
-                    request["id"],
-                    value=result.get("value"),
-                    role=result.get("role"),
+        except RequestException as e:
+            if retries <= 0:
+                return [e] * len(requestlist)
+            logger.warning(
+                "Error calling 'getRecordValues' for {} records: {} (will retry {} more times)".format(
+                    len(requestlist), repr(e), retries
+                )
+            )
+            half = (len(requestlist) + 1) // 2
+            return [
+                result
+                for part in (requestlist[:half], requestlist[half:])
+                if part
+                for result in self._post_get_record_values(part, retries=retries - 1)
+            ]
+
+    def call_sync_record_values(self, **kwargs):
+        """
+        Call the server's syncRecordValues endpoint to bring the local record store up to date. Rather than
+        downloading every record, this sends the version we have of each one, and the server only sends back
+        the records that have changed since (or that we don't have at all). The keyword arguments are the same
+        as for `call_get_record_values`.
+        """
+
+        requestlist = []
+
+        for table, ids in kwargs.items():
+
+            if ids is True:
+                ids = list(self._values.get(table, {}).keys())
+                if self._cache is not None:
+                    ids = list(set(ids + self._cache.ids(table)))
+            if isinstance(ids, str):
+                ids = [ids]
+
+            if self._client.in_transaction():
+                self._records_to_refresh[table] = list(
+                    set(self._records_to_refresh.get(table, []) + ids)
+                )
+                continue
+
+            for id in ids:
+                id = extract_id(id)
+                requestlist.append(
+                    {
+                        "pointer": {"table": table, "id": id},
+                        "version": self.get_current_version(table, id),
+                    }
+                )
+
+        if not requestlist:
+            return
+
+        batch_size = self.record_values_batch_size
+        batches = [
+            requestlist[i : i + batch_size]
+            for i in range(0, len(requestlist), batch_size)
+        ]
+
+        # as for `call_get_record_values`, keep the records we're syncing from evicting each other
+        keys = [
+            (request["pointer"]["table"], request["pointer"]["id"])
+            for request in requestlist
+        ]
+        self._pin(keys)
+        try:
+            errors = []
+            for results in self._client._map(self._post_sync_record_values, batches):
+                for result in results:
+                    if isinstance(result, Exception):
+                        errors.append(result)
+                    else:
+                        self.store_recordmap(result)
+        finally:
+            self._unpin(keys)
+
+        if errors:
+            logger.error(
+                "Failed to sync {} batches of records from 'syncRecordValues'".format(
+                    len(errors)
+                )
+            )
+            raise errors[0]
+
+    def _post_sync_record_values(self, requestlist, retries=None):
+        """
+        Call the syncRecordValues endpoint for a batch of requests, and return a list of the resulting record
+        maps. Failures are retried in the same way as for `_post_get_record_values`, with the exception in place
+        of the record map for any part of the batch that still failed.
+        """
+
+        if retries is None:
+            retries = self.record_values_retries
+
+        logger.debug(
+            "Calling 'syncRecordValues' endpoint for requests: {}".format(requestlist)
+        )
+
+        try:
+            response = self._client.post("syncRecordValues", {"requests": requestlist})
+            return [response.json()["recordMap"]]
+        except RequestException as e:
+            if retries <= 0:
+                return [e]
+            logger.warning(
+                "Error calling 'syncRecordValues' for {} records: {} (will retry {} more times)".format(
+                    len(requestlist), repr(e), retries
+                )
+            )
+            half = (len(requestlist) + 1) // 2
+            return [
+                result
+                for part in (requestlist[:half], requestlist[half:])
+                if part
+                for result in self._post_sync_record_values(part, retries=retries - 1)
+            ]
+
+    def prefetch(self, depth=0, **kwargs):
+        """
+        Make sure the specified records are in the local store, loading any that are missing with batched calls
+        to the getRecordValues endpoint. The keyword arguments map table names into lists of (or singular) record
+        IDs. For blocks, the children (i.e. the "content" list) are loaded too, recursively down to `depth` levels
+        below the specified blocks.
+        """
+
+        requested = {}
+        for table, ids in kwargs.items():
+            if isinstance(ids, str):
+                ids = [ids]
+            requested[table] = [extract_id(id) for id in ids]
+
+        while requested:
+
+            missing = {}
+            for table, ids in requested.items():
+                missing[table] = list(
+                    dict.fromkeys(id for id in ids if self._get(table, id) is Missing)
                 )
 
+            logger.debug(
+                "Prefetching {} missing records".format(
+                    sum(len(ids) for ids in missing.values())
+                )
+            )
+
+            self.call_get_record_values(**missing)
+
+            if depth <= 0 or not requested.get("block"):
+                break
+            depth -= 1
+
+            # descend a level, into the children of the blocks we just made sure we have
+            child_ids = []
+            for id in requested["block"]:
+                child_ids += (self._get("block", id) or {}).get("content", [])
+            requested = {"block": child_ids}
+
     def get_current_version(self, table, id):
-        values = self._get(table, id)
+        values = self._values[table].get(id)
         if values and "version" in values:
             return values["version"]
+        elif self._cache is not None:
+            # read the version from the cache's index, rather than deserializing the whole record
+            return self._cache.get_version(table, id)
         else:
             return -1
 
@@ -275,30 +864,102 @@ class RecordStore(object):
             self._pages_to_refresh.append(page_id)
             return
 
+        recordmap = self._post_load_page_chunk(page_id, limit=limit)["recordMap"]
+
+        self.store_recordmap(recordmap)
+
+    def _post_load_page_chunk(self, page_id, limit=100, cursor=None, chunk_number=0):
+
         data = {
             "pageId": page_id,
             "limit": limit,
-            "cursor": {"stack": []},
-            "chunkNumber": 0,
+            "cursor": cursor or {"stack": []},
+            "chunkNumber": chunk_number,
             "verticalColumns": False,
         }
 
-        recordmap = self._client.post("loadPageChunk", data).json()["recordMap"]
+        return self._client.post("loadPageChunk", data).json()
 
-        self.store_recordmap(recordmap)
+    def iter_page_chunks(self, page_id, limit=100):
+        """
+        Generator that loads a page one chunk (of up to `limit` blocks) at a time, following the cursor returned
+        by the server until the whole page has been loaded. Each chunk is stored as soon as it arrives, and then
+        the list of IDs of the blocks it contained is yielded. Every chunk also includes the page itself and its
+        ancestors, which are left out, so that each block in the page is yielded exactly once.
+        """
 
-    def store_recordmap(self, recordmap):
-        for table, records in recordmap.items():
-            if not isinstance(records, dict):
-                continue
-            for id, record in records.items():
-                if not isinstance(record, dict):
+        cursor = None
+        chunk_number = 0
+        # the blocks known to be inside the page (or not), so the chain of parents only has to be walked once
+        inside = {page_id}
+        outside = set()
+        yielded = set()
+
+        while True:
+
+            response = self._post_load_page_chunk(
+                page_id, limit=limit, cursor=cursor, chunk_number=chunk_number
+            )
+
+            recordmap = response["recordMap"]
+            self.store_recordmap(recordmap)
+            block_ids = []
+            for block_id in recordmap.get("block", {}):
+                if block_id in yielded or block_id == page_id:
                     continue
+                if self._is_inside(block_id, inside, outside):
+                    yielded.add(block_id)
+                    block_ids.append(block_id)
+            yield block_ids
+
+            cursor = response.get("cursor")
+            if not cursor or not cursor.get("stack"):
+                break
+            chunk_number += 1
+
+    def _is_inside(self, block_id, inside, outside):
+        """
+        Check whether a block is a descendant of any of the blocks in `inside`, by following its parents, and
+        add the blocks along the way to `inside` or `outside` accordingly.
+        """
+        chain = []
+        while block_id not in inside and block_id not in outside:
+            chain.append(block_id)
+            value = self._get("block", block_id)
+            if not value or value.get("parent_table") != "block":
+                break
+            block_id = value.get("parent_id")
+            if block_id in chain:
+                break
+        result = block_id in inside
+        (inside if result else outside).update(chain)
+        return result
+
+    def store_recordmap(self, recordmap):
+        records = [
+            (table, id, record)
+            for table, table_records in recordmap.items()
+            if isinstance(table_records, dict)
+            for id, record in table_records.items()
+            if isinstance(record, dict)
+        ]
+        # don't let the records evict each other while they're being stored
+        keys = [(table, id) for table, id, _ in records]
+        self._pin(keys)
+        try:
+            for table, id, record in records:
                 self._update_record(
-                    table, id, value=record.get("value"), role=record.get("role")
+                    table,
+                    id,
+                    value=record.get("value"),
+                    role=record.get("role"),
+                    flush=False,
                 )
+            self._flush_cache()
+        finally:
+            self._unpin(keys)
 
-    def call_query_collection(
+    def _post_query_collection(
         self,
         collection_id,
         collection_view_id,
@@ -311,7 +972,7 @@ class RecordStore(object):
         sort=[],
         calendar_by="",
         group_by="",
-        limit=50
+        limit=50,
     ):
 
         assert not (
@@ -325,10 +986,7 @@ class RecordStore(object):
             sort = [sort]
 
         data = {
-            "collectionView": {
-                "id": collection_view_id,
-                "spaceId": space_id
-            },
+            "collectionView": {"id": collection_view_id, "spaceId": space_id},
             "loader": {
                 "reducers": {
                     "collection_group_results": {
@@ -341,11 +999,7 @@ class RecordStore(object):
                 "userId": self._client.current_user.id,
                 "userTimeZone": str(get_localzone()),
             },
-            "source": {
-                "id": collection_id,
-                "spaceId": space_id,
-                "type": "collection"
-            }
+            "source": {"id": collection_id, "spaceId": space_id, "type": "collection"},
         }
 
         if filter:
@@ -357,7 +1011,11 @@ class RecordStore(object):
         if aggregations:
             data["loader"]["aggregations"] = aggregations
 
-        response = self._client.post("queryCollection", data).json()
+        return self._client.post("queryCollection", data).json()
+
+    def call_query_collection(self, *args, **kwargs):
+
+        response = self._post_query_collection(*args, **kwargs)
 
         self.store_recordmap(response["recordMap"])
 
@@ -372,28 +1030,93 @@ class RecordStore(object):
         self.call_get_record_values(**self._records_to_refresh)
         self._records_to_refresh = {}
 
-    def run_local_operations(self, operations):
+    def run_local_operations(self, operations, flush=True):
         """
         Called to simulate the results of running the operations on the server, to keep the record store in sync
         even when we haven't completed a refresh (or we did a refresh but the database hadn't actually updated yet...)
+
+        The operations are grouped by record, and applied to a new version of each record that shares everything
+        but the parts the operations touched with the old version, which is then stored with a single update.
         """
+
+        operations_by_record = defaultdict(list)
         for operation in operations:
-            self.run_local_operation(**operation)
+            operations_by_record[(operation["table"], operation["id"])].append(
+                operation
+            )
 
-    def run_local_operation(self, table, id, path, command, args):
+        for (table, record_id), record_operations in operations_by_record.items():
+            with self._lock_for(table, record_id):
+                new_val = dict(self._get(table, record_id) or {})
+                copied = {id(new_val)}
+                changed_keys = set()
+                for operation in record_operations:
+                    keys = self._apply_local_operation(
+                        new_val,
+                        copied,
+                        operation["path"],
+                        operation["command"],
+                        operation["args"],
+                    )
+                    if keys is None or changed_keys is None:
+                        changed_keys = None
+                    else:
+                        changed_keys.update(keys)
+                self._update_record(
+                    table,
+                    record_id,
+                    value=new_val,
+                    flush=False,
+                    local=True,
+                    changed_keys=changed_keys,
+                )
 
-        with self._mutex:
-            path = deepcopy(path)
-            new_val = deepcopy(self._values[table][id])
+        if flush:
+            self._flush_cache()
+
+    def run_local_operation(self, table, id, path, command, args, flush=True):
+        self.run_local_operations(
+            [
+                {
+                    "table": table,
+                    "id": id,
+                    "path": path,
+                    "command": command,
+                    "args": args,
+                }
+            ],
+            flush=flush,
+        )
 
-        ref = new_val
+    def _apply_local_operation(self, value, copied, path, command, args):
+        """
+        Apply an operation to a record's value, in place. Containers along the operation's path are shallow-copied
+        the first time they're modified (with the ids of those already copied tracked in `copied`), so the old
+        value is left untouched. Returns the top-level keys that may have changed, or None if it could be any.
+        """
+
+        path = list(path)
+        if path:
+            changed_keys = {path[0]}
+        elif command == "update":
+            changed_keys = set(args.keys())
+        else:
+            changed_keys = None
+
+        ref = value
 
         # loop and descend down the path until it's consumed, or if we're doing a "set", there's one key left
         while (len(path) > 1) or (path and command != "set"):
             comp = path.pop(0)
             if comp not in ref:
-                ref[comp] = [] if "list" in command else {}
-            ref = ref[comp]
+                child = [] if "list" in command else {}
+            else:
+                child = ref[comp]
+                if id(child) not in copied:
+                    child = copy(child)
+            copied.add(id(child))
+            ref[comp] = child
+            ref = child
 
         if command == "update":
             assert isinstance(ref, dict)
@@ -424,4 +1147,4 @@ class RecordStore(object):
             except ValueError:
                 pass
 
-        self._update_record(table, id, value=new_val)
+        return changed_keys